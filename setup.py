@@ -158,6 +158,7 @@ dist = setup(name=name,
         ],
     extras_require={
         'calendar': ['GooCalendar>=0.7'],
+        'xlsx': ['openpyxl'],
         },
     dependency_links=dependency_links,
     zip_safe=False,
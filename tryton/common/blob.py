@@ -0,0 +1,107 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import atexit
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class Blob(object):
+    "Reference to a content of the blob store"
+    __slots__ = ('store', 'digest', 'size', '_mmap')
+
+    def __init__(self, store, digest, size):
+        self.store = store
+        self.digest = digest
+        self.size = size
+        self._mmap = None
+
+    @property
+    def released(self):
+        return self.store is None
+
+    def view(self):
+        "Return a read-only memoryview of the content without copy"
+        if self.released:
+            raise ValueError("released blob")
+        if not self.size:
+            return memoryview(b'')
+        if self._mmap is None:
+            with open(self.store.filename(self.digest), 'rb') as fp:
+                self._mmap = mmap.mmap(
+                    fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def read(self):
+        with self.view() as view:
+            return view.tobytes()
+
+    def release(self):
+        if self.released:
+            return
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A memoryview is still exported, the garbage collector will
+                # unmap it
+                pass
+            self._mmap = None
+        store, self.store = self.store, None
+        store.release(self.digest)
+
+    # Called by Record.destroy
+    destroy = release
+
+
+class BlobStore(object):
+    "Session store of binary contents addressed by their hash"
+
+    def __init__(self):
+        self.counts = {}
+        self._path = None
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = tempfile.mkdtemp(prefix='tryton_')
+            atexit.register(shutil.rmtree, self._path, ignore_errors=True)
+        return self._path
+
+    def filename(self, digest):
+        return os.path.join(self.path, digest)
+
+    def add(self, data):
+        "Store the data and return a new Blob"
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        data = data or b''
+        digest = hashlib.sha1(data).hexdigest()
+        if digest not in self.counts:
+            fileno, tmp = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fileno, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp, self.filename(digest))
+            self.counts[digest] = 0
+        self.counts[digest] += 1
+        return Blob(self, digest, len(data))
+
+    def release(self, digest):
+        self.counts[digest] -= 1
+        if not self.counts[digest]:
+            del self.counts[digest]
+            try:
+                os.remove(self.filename(digest))
+            except OSError:
+                logger.debug("Unable to remove blob %s", digest, exc_info=True)
+
+    def __len__(self):
+        return len(self.counts)
+
+
+BLOBS = BlobStore()
@@ -3,6 +3,8 @@
 
 import colorsys
 import gettext
+import hashlib
+import json
 import locale
 import logging
 import os
@@ -23,7 +25,9 @@ try:
 except ImportError:
     from http import client as HTTPStatus
 
-import _thread
+import http.client
+import itertools
+import queue
 import shlex
 import socket
 import sys
@@ -32,18 +36,18 @@ import urllib.error
 import urllib.parse
 import urllib.request
 import webbrowser
-from functools import lru_cache, wraps
+from functools import partial, wraps
 from string import Template
 
 import tryton.rpc as rpc
-from tryton.config import CONFIG, PIXMAPS_DIR, TRYTON_ICON
+from tryton.config import CONFIG, PIXMAPS_DIR, TRYTON_ICON, get_config_dir
 
 try:
     import ssl
 except ImportError:
     ssl = None
 import zipfile
-from threading import Lock
+from threading import Lock, Thread, local
 
 from gi.repository import Gdk, GdkPixbuf, GLib, GObject, Gtk
 
@@ -51,6 +55,7 @@ from tryton import __version__
 from tryton.exceptions import TrytonError, TrytonServerError
 from tryton.pyson import PYSONEncoder
 
+from .thumbnail import THUMBNAILS
 from .underline import set_underline
 from .widget_style import widget_class
 
@@ -58,14 +63,154 @@ _ = gettext.gettext
 logger = logging.getLogger(__name__)
 
 
+class URLLoader(object):
+    "Pool of threads fetching URLs with persistent connections"
+    size = 4
+    max_redirects = 5
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = Lock()
+        self._threads = 0
+        self._idle = 0
+        self._callbacks = {}
+        self._local = local()
+
+    def fetch(self, url, callback):
+        "Call callback with the data of url or None in the main loop"
+        if url in self._callbacks:
+            self._callbacks[url].append(callback)
+            return
+        self._callbacks[url] = [callback]
+        with self._lock:
+            self._queue.put(url)
+            if (self._queue.qsize() > self._idle
+                    and self._threads < self.size):
+                self._threads += 1
+                Thread(target=self._work, daemon=True).start()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            url = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+            try:
+                data = self._get(url)
+            except Exception:
+                logger.info("Can not fetch %s", url, exc_info=True)
+                data = None
+            GLib.idle_add(self._done, url, data)
+
+    def _done(self, url, data):
+        for callback in self._callbacks.pop(url, []):
+            callback(data)
+
+    def _get(self, url):
+        cached = THUMBNAILS.load_data(url)
+        headers = {}
+        if cached:
+            _, validators = cached
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        location = url
+        for redirect in range(self.max_redirects):
+            status, response_headers, data = self._request(location, headers)
+            if (status in {301, 302, 303, 307, 308}
+                    and response_headers.get('Location')):
+                location = urllib.parse.urljoin(
+                    location, response_headers['Location'])
+            else:
+                break
+        if status == HTTPStatus.NOT_MODIFIED and cached:
+            return cached[0]
+        elif status != HTTPStatus.OK:
+            logger.info("Can not fetch %s: %s", url, status)
+            return
+        validators = {
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            }
+        if any(validators.values()):
+            THUMBNAILS.save_data(url, data, validators)
+        return data
+
+    def _connection(self, scheme, netloc, reset=False):
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        connections = self._local.connections
+        connection = connections.get((scheme, netloc))
+        if connection and reset:
+            connection.close()
+            connection = None
+        if not connection:
+            timeout = float(CONFIG['image.url_timeout'])
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(
+                    netloc, timeout=timeout,
+                    context=ssl.create_default_context())
+            else:
+                connection = http.client.HTTPConnection(
+                    netloc, timeout=timeout)
+            connections[(scheme, netloc)] = connection
+        return connection
+
+    def _request(self, url, headers):
+        "Return the status, the headers and the content of the response"
+        parts = urllib.parse.urlsplit(url)
+        if (parts.scheme not in {'http', 'https'}
+                or urllib.request.getproxies()):
+            request = urllib.request.Request(url, headers=headers)
+            try:
+                with urllib.request.urlopen(
+                        request, timeout=float(CONFIG['image.url_timeout'])
+                        ) as response:
+                    return (
+                        response.status, response.headers, response.read())
+            except urllib.error.HTTPError as exception:
+                return exception.code, exception.headers, b''
+        path = urllib.parse.urlunsplit(
+            ('', '', parts.path or '/', parts.query, ''))
+        # Retry once with a new connection if the server closed it
+        for retry in [False, True]:
+            connection = self._connection(
+                parts.scheme, parts.netloc, reset=retry)
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                return response.status, response.headers, response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                if retry:
+                    raise
+
+
+URL_LOADER = URLLoader()
+
+
 class IconFactory:
 
     batchnum = 10
-    _tryton_icons = []
     _name2id = {}
     _icons = {}
     _local_icons = {}
     _pixbufs = defaultdict(dict)
+    _url_callbacks = {}
+    _sizes = {
+        Gtk.IconSize.MENU: 16,
+        Gtk.IconSize.SMALL_TOOLBAR: 16,
+        Gtk.IconSize.LARGE_TOOLBAR: 24,
+        Gtk.IconSize.BUTTON: 16,
+        Gtk.IconSize.DND: 12,
+        Gtk.IconSize.DIALOG: 48,
+        }
+    # The sizes rasterized in advance
+    _preload_sizes = [
+        16, Gtk.IconSize.MENU, Gtk.IconSize.SMALL_TOOLBAR,
+        Gtk.IconSize.BUTTON, Gtk.IconSize.LARGE_TOOLBAR]
 
     @classmethod
     def load_local_icons(cls):
@@ -75,22 +220,114 @@ class IconFactory:
             cls._local_icons[name] = path
 
     @classmethod
-    def load_icons(cls, refresh=False):
+    def load_icons(cls, refresh=False, result=None):
         if not refresh:
             cls._name2id.clear()
             cls._icons.clear()
-        del cls._tryton_icons[:]
 
-        try:
-            icons = rpc.execute('model', 'ir.ui.icon', 'list_icons',
+        if result is None:
+            result = partial(rpc.execute, 'model', 'ir.ui.icon', 'list_icons',
                 rpc.CONTEXT)
+        try:
+            icons = result()
         except TrytonServerError:
             icons = []
         for icon_id, icon_name in icons:
             if refresh and icon_name in cls._icons:
                 continue
-            cls._tryton_icons.append((icon_id, icon_name))
             cls._name2id[icon_name] = icon_id
+        if not refresh and icons:
+            cls._load_cached_icons(icons)
+
+    @classmethod
+    def _cache_path(cls):
+        namespace = '%s/%s' % (CONFIG['login.host'], CONFIG['login.db'])
+        return os.path.join(
+            get_config_dir(), 'icons',
+            hashlib.sha1(namespace.encode('utf-8')).hexdigest() + '.json')
+
+    @classmethod
+    def _load_cached_icons(cls, icons):
+        "Load the icons from the disk or fetch them all if they changed"
+        version = hashlib.sha1(
+            json.dumps(sorted(map(list, icons))).encode('utf-8')).hexdigest()
+        try:
+            with open(cls._cache_path(), 'r') as fp:
+                cache = json.load(fp)
+        except (OSError, ValueError):
+            cache = {}
+        if cache.get('version') == version:
+            for name, data in cache['icons'].items():
+                if name in cls._name2id:
+                    cls._icons[name] = data.encode('utf-8')
+                    del cls._name2id[name]
+            cls.preload_icons()
+            return
+
+        def callback(result):
+            try:
+                icons = result()
+            except RPCException:
+                return
+            for icon in icons:
+                cls._icons[icon['name']] = icon['icon'].encode('utf-8')
+                cls._name2id.pop(icon['name'], None)
+            cls._save_cached_icons(version)
+            cls.preload_icons()
+        RPCExecute('model', 'ir.ui.icon', 'read',
+            list(cls._name2id.values()), ['name', 'icon'],
+            callback=callback, priority=RPCProgress.PRIORITY_BACKGROUND,
+            process_exception=False)
+
+    @classmethod
+    def _save_cached_icons(cls, version):
+        path = cls._cache_path()
+        try:
+            os.makedirs(os.path.dirname(path), 0o700, exist_ok=True)
+            fileno, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fileno, 'w') as fp:
+                json.dump({
+                        'version': version,
+                        'icons': {n: d.decode('utf-8')
+                            for n, d in cls._icons.items()},
+                        }, fp)
+            os.replace(tmp, path)
+        except OSError:
+            logger.info("Unable to store icons", exc_info=True)
+
+    @classmethod
+    def preload_icons(cls):
+        "Rasterize in a thread the icons with the default color"
+        icons = dict(cls._icons)
+        local_icons = dict(cls._local_icons)
+        color = CONFIG['icon.colors'].split(',')[0]
+
+        def rasterize():
+            pixbufs = defaultdict(dict)
+            for name in icons.keys() | local_icons.keys():
+                data = icons.get(name)
+                if data is None:
+                    try:
+                        with open(local_icons[name], 'rb') as fp:
+                            data = fp.read()
+                    except OSError:
+                        continue
+                rasterized = {}
+                for size in cls._preload_sizes:
+                    width = cls._sizes.get(size, size)
+                    if width not in rasterized:
+                        rasterized[width] = cls._rasterize(
+                            data, width, color)
+                    pixbufs[(size, None)][name] = rasterized[width]
+            GLib.idle_add(cls._set_pixbufs, pixbufs)
+        Thread(target=rasterize, daemon=True).start()
+
+    @classmethod
+    def _set_pixbufs(cls, pixbufs):
+        for key, named in pixbufs.items():
+            for name, pixbuf in named.items():
+                cls._pixbufs[key].setdefault(name, pixbuf)
 
     @classmethod
     def register_icon(cls, iconname):
@@ -101,14 +338,15 @@ class IconFactory:
             return
         if iconname not in cls._name2id:
             cls.load_icons(refresh=True)
-        try:
-            icon_ref = (cls._name2id[iconname], iconname)
-        except KeyError:
+        if iconname not in cls._name2id:
             return
-        idx = cls._tryton_icons.index(icon_ref)
-        to_load = slice(max(0, idx - cls.batchnum // 2),
-            idx + cls.batchnum // 2)
-        ids = [e[0] for e in cls._tryton_icons[to_load]]
+        # Load with the icon a batch of the not yet loaded icons
+        ids = [cls._name2id[iconname]]
+        for name, icon_id in cls._name2id.items():
+            if len(ids) >= cls.batchnum:
+                break
+            if name != iconname:
+                ids.append(icon_id)
         try:
             icons = rpc.execute('model', 'ir.ui.icon', 'read', ids,
                 ['name', 'icon'], rpc.CONTEXT)
@@ -116,10 +354,32 @@ class IconFactory:
             icons = []
         for icon in icons:
             name = icon['name']
-            data = icon['icon'].encode('utf-8')
-            cls._icons[name] = data
-            cls._tryton_icons.remove((icon['id'], icon['name']))
-            del cls._name2id[icon['name']]
+            cls._icons[name] = icon['icon'].encode('utf-8')
+            cls._name2id.pop(name, None)
+
+    @staticmethod
+    def _rasterize(data, size, color, badge=None):
+        colors = CONFIG['icon.colors'].split(',')
+        try:
+            ET.register_namespace('', 'http://www.w3.org/2000/svg')
+            root = ET.fromstring(data)
+            root.attrib['fill'] = color
+            if badge:
+                if not isinstance(badge, str):
+                    try:
+                        badge = colors[badge]
+                    except IndexError:
+                        badge = color
+                ET.SubElement(root, 'circle', {
+                        'cx': '20',
+                        'cy': '4',
+                        'r': '4',
+                        'fill': badge,
+                        })
+            data = ET.tostring(root)
+        except ET.ParseError:
+            pass
+        return data2pixbuf(data, size, size)
 
     @classmethod
     def get_pixbuf(cls, iconname, size=16, color=None, badge=None):
@@ -139,34 +399,8 @@ class IconFactory:
                 return
             if not color:
                 color = colors[0]
-            try:
-                ET.register_namespace('', 'http://www.w3.org/2000/svg')
-                root = ET.fromstring(data)
-                root.attrib['fill'] = color
-                if badge:
-                    if not isinstance(badge, str):
-                        try:
-                            badge = colors[badge]
-                        except IndexError:
-                            badge = color
-                    ET.SubElement(root, 'circle', {
-                            'cx': '20',
-                            'cy': '4',
-                            'r': '4',
-                            'fill': badge,
-                            })
-                data = ET.tostring(root)
-            except ET.ParseError:
-                pass
-            width = height = {
-                Gtk.IconSize.MENU: 16,
-                Gtk.IconSize.SMALL_TOOLBAR: 16,
-                Gtk.IconSize.LARGE_TOOLBAR: 24,
-                Gtk.IconSize.BUTTON: 16,
-                Gtk.IconSize.DND: 12,
-                Gtk.IconSize.DIALOG: 48,
-                }.get(size, size)
-            pixbuf = data2pixbuf(data, width, height)
+            pixbuf = cls._rasterize(
+                data, cls._sizes.get(size, size), color, badge)
             cls._pixbufs[(size, badge)][iconname] = pixbuf
         return cls._pixbufs[(size, badge)][iconname]
 
@@ -197,16 +431,24 @@ class IconFactory:
         return urllib.parse.urlunsplit(parts)
 
     @classmethod
-    @lru_cache(maxsize=CONFIG['image.cache_size'])
-    def get_pixbuf_url(cls, url, size=16, size_param=None):
+    def get_pixbuf_url(cls, url, size=16, size_param=None, callback=None):
+        "Return the pixbuf of url or None and call callback once loaded"
         if not url:
             return
-        url = cls._convert_url(url, size, size_param=size_param)
-        try:
-            with urllib.request.urlopen(url) as response:
-                return data2pixbuf(response.read(), size, size)
-        except urllib.error.URLError:
-            logger.info("Can not fetch %s", url, exc_info=True)
+        key = ('url', url, size, size_param)
+        if key in THUMBNAILS:
+            return THUMBNAILS[key]
+        if key not in cls._url_callbacks:
+            cls._url_callbacks[key] = set()
+
+            def loaded(data):
+                THUMBNAILS[key] = data2pixbuf(data, size, size)
+                for callback in cls._url_callbacks.pop(key):
+                    callback()
+            URL_LOADER.fetch(
+                cls._convert_url(url, size, size_param=size_param), loaded)
+        if callback:
+            cls._url_callbacks[key].add(callback)
 
 
 IconFactory.load_local_icons()
@@ -218,14 +460,16 @@ class ModelAccess(object):
     _access = {}
     _models = []
 
-    def load_models(self, refresh=False):
+    def load_models(self, refresh=False, result=None):
         if not refresh:
             self._access.clear()
         del self._models[:]
 
-        try:
-            self._models = rpc.execute('model', 'ir.model', 'list_models',
+        if result is None:
+            result = partial(rpc.execute, 'model', 'ir.model', 'list_models',
                 rpc.CONTEXT)
+        try:
+            self._models = result()
         except TrytonServerError:
             pass
 
@@ -252,11 +496,13 @@ MODELACCESS = ModelAccess()
 class ModelHistory(object):
     _models = set()
 
-    def load_history(self):
+    def load_history(self, result=None):
         self._models.clear()
+        if result is None:
+            result = partial(rpc.execute, 'model', 'ir.model',
+                'list_history', rpc.CONTEXT)
         try:
-            self._models.update(rpc.execute('model', 'ir.model',
-                    'list_history', rpc.CONTEXT))
+            self._models.update(result())
         except TrytonServerError:
             pass
 
@@ -292,10 +538,12 @@ MODELNAME = ModelName()
 class ModelNotification:
     _depends = None
 
-    def load_names(self):
-        try:
-            self._depends = rpc.execute(
+    def load_names(self, result=None):
+        if result is None:
+            result = partial(rpc.execute,
                 'model', 'ir.model', 'get_notification', rpc.CONTEXT)
+        try:
+            self._depends = result()
         except TrytonServerError:
             pass
 
@@ -319,10 +567,12 @@ class ViewSearch(object):
                 return super(Encoder, self).default(obj)
         self.encoder = Encoder()
 
-    def load_searches(self):
-        try:
-            self.searches = rpc.execute('model', 'ir.ui.view_search',
+    def load_searches(self, result=None):
+        if result is None:
+            result = partial(rpc.execute, 'model', 'ir.ui.view_search',
                 'get_search', rpc.CONTEXT)
+        try:
+            self.searches = result()
         except TrytonServerError:
             self.searches = {}
 
@@ -1188,15 +1438,67 @@ class RPCException(Exception):
         self.exception = exception
 
 
+class RPCExecutor(object):
+    "Pool of threads running the asynchronous calls by priority"
+
+    def __init__(self):
+        self._queue = queue.PriorityQueue()
+        self._lock = Lock()
+        self._sequence = itertools.count()
+        self._threads = 0
+        self._idle = 0
+        self.submitted = self.cancelled = self.max_depth = 0
+
+    def submit(self, progress):
+        with self._lock:
+            self.submitted += 1
+            self._queue.put(
+                (progress.priority, next(self._sequence), progress))
+            depth = self._queue.qsize()
+            self.max_depth = max(self.max_depth, depth)
+            if (depth > self._idle
+                    and self._threads < int(CONFIG['client.rpc_workers'])):
+                self._threads += 1
+                Thread(target=self._work, daemon=True).start()
+        logger.debug('RPC queue statistics: %s', self.statistics)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            _, _, progress = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+            if not progress.cancelled:
+                progress.start()
+
+    @property
+    def statistics(self):
+        return {
+            'depth': self._queue.qsize(),
+            'max_depth': self.max_depth,
+            'submitted': self.submitted,
+            'cancelled': self.cancelled,
+            'threads': self._threads,
+            }
+
+
+RPC_EXECUTOR = RPCExecutor()
+
+
 class RPCProgress(object):
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_BACKGROUND = 10
 
-    def __init__(self, method, args):
+    def __init__(self, method, args, priority=PRIORITY_INTERACTIVE):
         self.method = method
         self.args = args
+        self.priority = priority
         self.parent = None
         self.res = None
         self.error = False
         self.exception = None
+        self.cancelled = False
 
     def start(self):
         try:
@@ -1208,7 +1510,7 @@ class RPCProgress(object):
         else:
             if not self.res:
                 self.error = True
-        if self.callback:
+        if self.callback and not self.cancelled:
             # Post to GTK queue to be run by the main thread
             GLib.idle_add(self.process)
         return True
@@ -1222,12 +1524,19 @@ class RPCProgress(object):
             # otherwise the cursor is not updated.
             self.parent = get_toplevel_window()
             GLib.timeout_add(3000, self._set_cursor)
-            _thread.start_new_thread(self.start, ())
-            return
+            RPC_EXECUTOR.submit(self)
+            return self
         else:
             self.start()
             return self.process()
 
+    def cancel(self):
+        "Prevent the callback to be called"
+        if not self.cancelled:
+            self.cancelled = True
+            RPC_EXECUTOR.cancelled += 1
+            self._reset_cursor()
+
     def _set_cursor(self):
         if self.parent:
             window = self.parent.get_window()
@@ -1237,20 +1546,38 @@ class RPCProgress(object):
                     display, Gdk.CursorType.WATCH)
                 window.set_cursor(watch)
 
-    def process(self):
+    def _reset_cursor(self):
         if self.parent and self.parent.get_window():
             self.parent.get_window().set_cursor(None)
-            self.parent = None
+        self.parent = None
+
+    def process(self):
+        self._reset_cursor()
+        if self.cancelled:
+            return
 
         if self.exception and self.process_exception_p:
-            def rpc_execute(*args):
-                return RPCProgress('execute', args).run(
-                    self.process_exception_p, self.callback)
+            if self.method == 'execute_multi':
+                # The errors of each call are raised by its result so only
+                # the whole request can be sent again
+                def rpc_execute(*args):
+                    return RPCProgress(
+                        self.method, self.args, self.priority).run(
+                        self.process_exception_p, self.callback)
+            else:
+                def rpc_execute(*args):
+                    return RPCProgress('execute', args, self.priority).run(
+                        self.process_exception_p, self.callback)
             try:
-                return process_exception(
+                result = process_exception(
                     self.exception, *self.args, rpc_execute=rpc_execute)
             except RPCException as exception:
                 self.exception = exception
+            else:
+                if self.callback:
+                    # The new call will run the callback
+                    return
+                return result
 
         def return_():
             if self.exception:
@@ -1271,7 +1598,22 @@ def RPCExecute(*args, **kwargs):
     args = args + (rpc_context,)
     process_exception = kwargs.get('process_exception', True)
     callback = kwargs.get('callback')
-    return RPCProgress('execute', args).run(process_exception, callback)
+    priority = kwargs.get('priority', RPCProgress.PRIORITY_INTERACTIVE)
+    return RPCProgress('execute', args, priority).run(
+        process_exception, callback)
+
+
+def RPCExecuteMulti(*calls, **kwargs):
+    "Execute the calls in a single request"
+    rpc_context = rpc.CONTEXT.copy()
+    if kwargs.get('context'):
+        rpc_context.update(kwargs['context'])
+    calls = tuple(call + (rpc_context,) for call in calls)
+    process_exception = kwargs.get('process_exception', True)
+    callback = kwargs.get('callback')
+    priority = kwargs.get('priority', RPCProgress.PRIORITY_INTERACTIVE)
+    return RPCProgress('execute_multi', calls, priority).run(
+        process_exception, callback)
 
 
 def RPCContextReload(callback=None):
@@ -61,8 +61,13 @@ def update_completion(entry, record, field, model, domain=None):
             completion_model.search_text = search_text
             # Force display of popup
             entry.emit('changed')
+        # Cancel the search of a previous text
+        progress = getattr(completion_model, 'progress', None)
+        if progress:
+            progress.cancel()
         try:
-            RPCExecute('model', model, 'search_read', domain, 0,
+            completion_model.progress = RPCExecute(
+                'model', model, 'search_read', domain, 0,
                 CONFIG['client.limit'], order, ['rec_name'], context=context,
                 process_exception=False, callback=callback)
         except Exception:
@@ -11,13 +11,18 @@ class EvalEnvironment(dict):
         self.eval_type = eval_type
 
     def __getitem__(self, item):
+        if super(EvalEnvironment, self).__contains__(item):
+            return super(EvalEnvironment, self).__getitem__(item)
         if item == 'id':
             return self.parent.id
         if item == '_parent_' + self.parent.parent_name and self.parent.parent:
             return EvalEnvironment(self.parent.parent,
                 eval_type=self.eval_type)
         if self.eval_type == 'eval':
-            return self.parent.get_eval()[item]
+            field = self.parent.group.fields[item]
+            if item not in self.parent._loaded and self.parent.id >= 0:
+                raise KeyError(item)
+            return field.get_eval(self.parent)
         else:
             return self.parent.group.fields[item].get_on_change_value(
                 self.parent)
@@ -44,12 +49,15 @@ class EvalEnvironment(dict):
     __repr__ = __str__
 
     def __contains__(self, item):
+        if super(EvalEnvironment, self).__contains__(item):
+            return True
         if item == 'id':
             return True
         if item == '_parent_' + self.parent.parent_name and self.parent.parent:
             return True
         if self.eval_type == 'eval':
-            return item in self.parent.get_eval()
+            return (item in self.parent.group.fields
+                and (item in self.parent._loaded or self.parent.id < 0))
         else:
             return item in self.parent.group.fields
 
@@ -0,0 +1,168 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from gi.repository import GdkPixbuf, GLib
+
+from tryton.config import CONFIG, get_config_dir
+
+logger = logging.getLogger(__name__)
+_PATH = os.path.join(get_config_dir(), 'thumbnails')
+
+
+class ThumbnailCache(object):
+    "Cache of pixbufs bounded by their decoded size with a disk tier"
+
+    def __init__(self):
+        self.used = 0
+        self._pixbufs = OrderedDict()
+        self._path = None
+        self._path_lock = threading.Lock()
+
+    @property
+    def size(self):
+        return int(CONFIG['image.thumbnail_memory'])
+
+    @property
+    def path(self):
+        "The directory of the disk tier or None"
+        if self._path is None:
+            # The disk tier is first used from the decoding threads
+            with self._path_lock:
+                if self._path is None:
+                    self._path = self._init_path()
+        return self._path
+
+    def _init_path(self):
+        if not CONFIG['image.thumbnail_persistent']:
+            return ''
+        try:
+            os.makedirs(_PATH, 0o700, exist_ok=True)
+            self._clean(_PATH)
+        except OSError:
+            logger.warning(
+                "Unable to use thumbnail directory %s", _PATH, exc_info=True)
+            return ''
+        return _PATH
+
+    @staticmethod
+    def _nbytes(pixbuf):
+        # Count the empty entries to bound their number
+        return pixbuf.get_byte_length() if pixbuf else 64
+
+    def __contains__(self, key):
+        return key in self._pixbufs
+
+    def __getitem__(self, key):
+        pixbuf = self._pixbufs[key]
+        self._pixbufs.move_to_end(key)
+        return pixbuf
+
+    def __setitem__(self, key, pixbuf):
+        if key in self._pixbufs:
+            self.used -= self._nbytes(self._pixbufs.pop(key))
+        self._pixbufs[key] = pixbuf
+        self.used += self._nbytes(pixbuf)
+        while self.used > self.size and len(self._pixbufs) > 1:
+            _, old = self._pixbufs.popitem(last=False)
+            self.used -= self._nbytes(old)
+
+    def clear(self):
+        self._pixbufs.clear()
+        self.used = 0
+
+    def _filename(self, key, extension='.png'):
+        # The ids are only unique per server and database
+        key = repr((CONFIG['login.host'], CONFIG['login.db'], key))
+        return os.path.join(
+            self.path,
+            hashlib.sha1(key.encode('utf-8')).hexdigest() + extension)
+
+    def load(self, key):
+        "Return the pixbuf stored on disk or None"
+        if not self.path:
+            return
+        filename = self._filename(key)
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(filename)
+            # Keep the most recently used files on clean
+            os.utime(filename)
+        except (GLib.GError, OSError):
+            return
+        return pixbuf
+
+    def save(self, key, pixbuf):
+        "Store the pixbuf on disk"
+        if not self.path or not pixbuf:
+            return
+        try:
+            fileno, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            os.close(fileno)
+            pixbuf.savev(tmp, 'png', [], [])
+            os.replace(tmp, self._filename(key))
+        except (GLib.GError, OSError):
+            logger.info("Unable to store thumbnail", exc_info=True)
+
+    def load_data(self, key):
+        "Return the data and its validators stored on disk or None"
+        if not self.path:
+            return
+        filename = self._filename(key, '.data')
+        try:
+            with open(filename + '.json', 'r') as fp:
+                validators = json.load(fp)
+            with open(filename, 'rb') as fp:
+                data = fp.read()
+            # Keep both files on clean
+            os.utime(filename)
+            os.utime(filename + '.json')
+        except (OSError, ValueError):
+            return
+        return data, validators
+
+    def save_data(self, key, data, validators):
+        "Store the data with its validators on disk"
+        if not self.path:
+            return
+        filename = self._filename(key, '.data')
+        try:
+            for content, path, mode in [
+                    (data, filename, 'wb'),
+                    (json.dumps(validators), filename + '.json', 'w')]:
+                fileno, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+                with os.fdopen(fileno, mode) as fp:
+                    fp.write(content)
+                os.replace(tmp, path)
+        except OSError:
+            logger.info("Unable to store data", exc_info=True)
+
+    def clean(self):
+        "Remove the least recently used files above the limit"
+        if self.path:
+            self._clean(self.path)
+
+    def _clean(self, path):
+        files_max = int(CONFIG['image.thumbnail_persistent_size'])
+        if not files_max:
+            return
+        files = []
+        for entry in os.scandir(path):
+            try:
+                files.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                pass
+        files.sort(reverse=True)
+        for _, filename in files[files_max:]:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+
+THUMBNAILS = ThumbnailCache()
@@ -56,19 +56,33 @@ class ConfigManager(object):
             'client.language_direction': 'ltr',
             'client.email': '',
             'client.limit': 1000,
+            'client.export_chunk': 1000,
+            'client.import_chunk': 1000,
+            'client.import_parallel': 1,
             'client.check_version': True,
             'client.bus_timeout': 10 * 60,
+            'client.rpc_workers': 8,
             'icon.colors': '#3465a4,#555753,#cc0000',
             'tree.colors': '#777,#198754,#ffc107,#dc3545',
             'calendar.colors': '#fff,#3465a4',
             'graph.color': '#3465a4',
             'image.max_size': 10 ** 6,
-            'image.cache_size': 1024,
+            'image.url_timeout': 10,
+            'image.thumbnail_memory': 32 * 1024 * 1024,
+            'image.thumbnail_persistent': False,
+            'image.thumbnail_persistent_size': 5000,
             'doc.url': 'https://docs.tryton.org/en/%(version)s',
             'bug.url': 'https://bugs.tryton.org/',
             'download.url': 'https://downloads-cdn.tryton.org/',
             'download.frequency': 60 * 60 * 8,
             'menu.pane': 200,
+            'connection.pool_min': 2,
+            'connection.pool_max': 16,
+            'connection.idle_timeout': 60,
+            'cache.memory': 64 * 1024 * 1024,
+            'cache.prefix_memory': 16 * 1024 * 1024,
+            'cache.persistent': False,
+            'cache.persistent_size': 5000,
         }
         self.config = {}
         self.options = {}
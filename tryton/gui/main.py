@@ -6,7 +6,6 @@ import json
 import logging
 import os
 import sys
-import threading
 import traceback
 import webbrowser
 from urllib.parse import parse_qsl, unquote, urlparse
@@ -22,7 +21,8 @@ from tryton.common import RPCContextReload, RPCException, RPCExecute
 from tryton.common.cellrendererclickablepixbuf import (
     CellRendererClickablePixbuf)
 from tryton.config import CONFIG, TRYTON_ICON, get_config_dir
-from tryton.exceptions import TrytonError, TrytonServerUnavailable
+from tryton.exceptions import (
+    TrytonError, TrytonServerError, TrytonServerUnavailable)
 from tryton.gui.window import Window
 from tryton.jsonrpc import object_hook
 from tryton.pyson import PYSONDecoder
@@ -521,19 +521,23 @@ class Main(Gtk.Application):
         except RPCException:
             prefs = {}
 
-        threads = []
-        for target in (
-                common.IconFactory.load_icons,
-                common.MODELACCESS.load_models,
-                common.MODELHISTORY.load_history,
-                common.MODELNOTIFICATION.load_names,
-                common.VIEW_SEARCH.load_searches,
-                ):
-            t = threading.Thread(target=target)
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        loaders = [
+            (common.IconFactory.load_icons, 'ir.ui.icon', 'list_icons'),
+            (common.MODELACCESS.load_models, 'ir.model', 'list_models'),
+            (common.MODELHISTORY.load_history, 'ir.model', 'list_history'),
+            (common.MODELNOTIFICATION.load_names,
+                'ir.model', 'get_notification'),
+            (common.VIEW_SEARCH.load_searches,
+                'ir.ui.view_search', 'get_search'),
+            ]
+        try:
+            results = rpc.execute_multi(*(
+                    ('model', model, method, rpc.CONTEXT)
+                    for _, model, method in loaders))
+        except (TrytonServerError, TrytonServerUnavailable):
+            results = [None] * len(loaders)
+        for (loader, _, _), result in zip(loaders, results):
+            loader(result=result)
         if prefs and 'language_direction' in prefs:
             translate.set_language_direction(prefs['language_direction'])
             CONFIG['client.language_direction'] = \
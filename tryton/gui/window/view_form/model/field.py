@@ -5,8 +5,6 @@ import decimal
 import locale
 import logging
 import math
-import os
-import tempfile
 from decimal import Decimal
 from itertools import chain
 
@@ -15,6 +13,7 @@ from tryton.common import (
     EvalEnvironment, RPCException, RPCExecute, concat, domain_inversion,
     eval_domain, extract_reference_models, filter_leaf, inverse_leaf,
     localize_domain, merge, prepare_reference_domain, simplify, unique_value)
+from tryton.common.blob import BLOBS, Blob
 from tryton.common.htmltextbuffer import guess_decode
 from tryton.config import CONFIG
 from tryton.pyson import PYSONDecoder
@@ -1002,58 +1001,61 @@ class ReferenceField(Field):
             concat(screen_domain, attr_domain), self.name)
 
 
-class _FileCache(object):
-    def __init__(self, path):
-        self.path = path
-
-    def __del__(self):
-        try:
-            os.remove(self.path)
-        except IOError:
-            pass
-
-
 class BinaryField(Field):
 
     _default = None
 
+    def set(self, record, value):
+        old = record.value.get(self.name)
+        super().set(record, value)
+        if isinstance(old, Blob) and old is not value:
+            old.release()
+
     def get(self, record):
         result = record.value.get(self.name, self._default)
-        if isinstance(result, _FileCache):
+        if isinstance(result, Blob):
             try:
-                with open(result.path, 'rb') as fp:
-                    result = fp.read()
-            except IOError:
-                result = self.get_data(record)
+                result = result.read()
+            except (OSError, ValueError):
+                result = self.get_data(record, reload=True)
         return result
 
     def get_client(self, record):
         return self.get(record)
 
     def set_client(self, record, value, force_change=False):
-        _, filename = tempfile.mkstemp(prefix='tryton_')
-        data = value or b''
-        if isinstance(data, str):
-            data = data.encode('utf-8')
-        with open(filename, 'wb') as fp:
-            fp.write(data)
-        self.set(record, _FileCache(filename))
+        self.set(record, BLOBS.add(value))
         self.sig_changed(record)
         record.validate(softvalidation=True)
         record.set_modified(self.name)
 
     def get_size(self, record):
         result = record.value.get(self.name) or 0
-        if isinstance(result, _FileCache):
-            result = os.stat(result.path).st_size
+        if isinstance(result, Blob):
+            result = result.size
         elif isinstance(result, (str, bytes)):
             result = len(result)
         return result
 
-    def get_data(self, record):
-        if not isinstance(record.value.get(self.name),
-                (str, bytes, _FileCache)):
+    def get_blob(self, record):
+        "Return the Blob of the value to access its size, digest or view"
+        value = record.value.get(self.name)
+        if isinstance(value, (str, bytes)):
+            self.set(record, BLOBS.add(value))
+        elif not isinstance(value, Blob) or value.released:
+            self.get_data(record)
+        value = record.value.get(self.name)
+        if isinstance(value, Blob):
+            return value
+
+    def get_data(self, record, reload=False):
+        value = record.value.get(self.name)
+        if reload or not isinstance(value, (str, bytes, Blob)):
             if record.id < 0:
+                if isinstance(value, Blob):
+                    raise ValueError(
+                        "Binary %s of new record %s released"
+                        % (self.name, record.id))
                 return b''
             context = record.get_context()
             try:
@@ -1061,15 +1063,16 @@ class BinaryField(Field):
                     [record.id], [self.name], context=context)
             except RPCException:
                 return b''
-            _, filename = tempfile.mkstemp(prefix='tryton_')
-            data = values[self.name] or b''
-            if isinstance(data, str):
-                data = data.encode('utf-8')
-            with open(filename, 'wb') as fp:
-                fp.write(data)
-            self.set(record, _FileCache(filename))
+            blob = BLOBS.add(values[self.name])
+            self.set(record, blob)
+            return blob.read()
         return self.get(record)
 
+    def release(self, record):
+        value = record.value.get(self.name)
+        if isinstance(value, Blob):
+            value.release()
+
 
 class DictField(Field):
 
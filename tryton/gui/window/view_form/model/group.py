@@ -1,15 +1,107 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 import operator
+from collections import Counter
+from functools import partial
+from itertools import chain
 
 from tryton import rpc
-from tryton.common import MODELACCESS, RPCException, RPCExecute
+from tryton.common import MODELACCESS, RPCException, RPCExecute, RPCProgress
 from tryton.common.domain_inversion import is_leaf
+from tryton.config import CONFIG
 
-from .field import Field, M2OField, ReferenceField
+from .field import BinaryField, Field, M2OField, O2MField, ReferenceField
 from .record import Record
 
 
+def _aggregate(values, result=None):
+    if result is None:
+        result = [0, None, None, None, 0]
+    count, sum_, min_, max_, digits = result
+    for value, value_digits in values:
+        if value is None:
+            continue
+        if not count:
+            sum_ = min_ = max_ = value
+        else:
+            sum_ += value
+            min_ = min(min_, value)
+            max_ = max(max_, value)
+        count += 1
+        if digits is not None:
+            if value_digits is None:
+                digits = None
+            else:
+                digits = max(digits, value_digits)
+    return [count, sum_, min_, max_, digits]
+
+
+class _Aggregate:
+    "Running aggregates of the values of a field over records"
+
+    def __init__(self, name):
+        self.name = name
+        self.values = {}
+        self.unloaded = set()
+        self.digits = Counter()
+        self._result = None
+
+    def add(self, record):
+        self.remove(record)
+        if not record.get_loaded([self.name]) and record.id >= 0:
+            self.unloaded.add(record)
+            return
+        field = record.group.fields[self.name]
+        value = field.get(record)
+        digits = 0
+        if value is not None and hasattr(field, 'digits'):
+            field_digits = field.digits(record)
+            digits = field_digits[1] if field_digits else None
+        self.values[record] = value, digits
+        if value is not None:
+            self.digits[digits] += 1
+        if self._result is not None:
+            self._result = _aggregate([(value, digits)], self._result)
+
+    def remove(self, record):
+        self.unloaded.discard(record)
+        value, digits = self.values.pop(record, (None, 0))
+        if value is None:
+            return
+        self.digits[digits] -= 1
+        if not self.digits[digits]:
+            del self.digits[digits]
+        if self._result is None:
+            return
+        count, sum_, min_, max_, _ = self._result
+        # Subtracting float accumulates rounding errors
+        if (count <= 1 or isinstance(value, float)
+                or value == min_ or value == max_):
+            self._result = None
+        else:
+            self._result = [count - 1, sum_ - value, min_, max_, None]
+
+    def get(self, records=None):
+        if records is not None:
+            values = self.values
+            result = _aggregate(values[r] for r in records if r in values)
+        else:
+            if self._result is None:
+                self._result = _aggregate(self.values.values())
+            result = self._result
+            result[-1] = (
+                None if None in self.digits else max(self.digits, default=0))
+        count, sum_, min_, max_, digits = result
+        return {
+            'count': count,
+            'sum': sum_,
+            'min': min_,
+            'max': max_,
+            'avg': sum_ / count if count else None,
+            'digits': digits,
+            }
+
+
 class Group(list):
 
     def __init__(self, model_name, fields, ids=None, parent=None,
@@ -32,11 +124,16 @@ class Group(list):
         self.fields = {}
         self.load_fields(fields)
         self.current_idx = None
+        self.__aggregates = {}
+        self.__aggregate_changed = set()
         self.load(ids)
         self.record_deleted, self.record_removed = [], []
         self.on_write = set()
         self.__readonly = readonly
         self.__id2record = {}
+        self.__positions = None
+        self.__prefetching = set()
+        self.__fetching = {}
         self.__field_childs = None
         self.exclude_field = None
         self.skip_model_access = False
@@ -92,6 +189,43 @@ class Group(list):
 
     domain4inversion = property(__get_domain4inversion)
 
+    def index(self, record, *args):
+        if args:
+            return super().index(record, *args)
+        # The positions are computed once and updated when the list changes
+        if self.__positions is None:
+            self.__positions = {id(r): i for i, r in enumerate(self)}
+        try:
+            return self.__positions[id(record)]
+        except KeyError:
+            raise ValueError('%r is not in group' % record)
+
+    def __contains__(self, record):
+        try:
+            self.index(record)
+        except ValueError:
+            return False
+        return True
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.__positions = None
+
+    def __shift_positions(self, start):
+        "Update the positions of the records from start"
+        if self.__positions is not None:
+            for i in range(start, self.__len__()):
+                self.__positions[id(self.__getitem__(i))] = i
+
+    def pop(self, *args):
+        record = super().pop(*args)
+        if self.__positions is not None:
+            del self.__positions[id(record)]
+            if args:
+                self.__shift_positions(args[0] % (self.__len__() + 1))
+        self.__aggregate_remove(record)
+        return record
+
     def insert(self, pos, record):
         assert record.group is self
         pos = min(pos, len(self))
@@ -102,7 +236,9 @@ class Group(list):
         else:
             record.next[id(self)] = None
         super(Group, self).insert(pos, record)
+        self.__shift_positions(pos)
         self.__id2record[record.id] = record
+        self.record_value_changed(record)
         if not self.lock_signal:
             self._group_list_changed('record-added', record, pos)
 
@@ -112,7 +248,10 @@ class Group(list):
             self.__getitem__(self.__len__() - 1).next[id(self)] = record
         record.next[id(self)] = None
         super(Group, self).append(record)
+        if self.__positions is not None:
+            self.__positions[id(record)] = self.__len__() - 1
         self.__id2record[record.id] = record
+        self.record_value_changed(record)
         if not self.lock_signal:
             self._group_list_changed(
                 'record-added', record, self.__len__() - 1)
@@ -127,8 +266,41 @@ class Group(list):
                 self.__getitem__(idx - 1).next[id(self)] = None
         self._group_list_changed('record-removed', record, idx)
         super(Group, self).remove(record)
+        if self.__positions is not None:
+            del self.__positions[id(record)]
+            self.__shift_positions(idx)
+        self.__aggregate_remove(record)
         del self.__id2record[record.id]
 
+    def record_value_changed(self, record):
+        if self.__aggregates:
+            self.__aggregate_changed.add(record)
+
+    def __aggregate_remove(self, record):
+        self.__aggregate_changed.discard(record)
+        for aggregate in self.__aggregates.values():
+            aggregate.remove(record)
+
+    def get_aggregate(self, name, records=None):
+        """Return the count, sum, min, max, avg and digits of the field name
+        for the records or for the group
+        or None if a record of the group is not loaded"""
+        if name not in self.__aggregates:
+            aggregate = self.__aggregates[name] = _Aggregate(name)
+            for record in self:
+                aggregate.add(record)
+        if self.__aggregate_changed:
+            for record in self.__aggregate_changed:
+                if record not in self:
+                    continue
+                for aggregate in self.__aggregates.values():
+                    aggregate.add(record)
+            self.__aggregate_changed.clear()
+        aggregate = self.__aggregates[name]
+        if aggregate.unloaded:
+            return None
+        return aggregate.get(records)
+
     def clear(self):
         # Use reversed order to minimize the cursor reposition as the cursor
         # has more chances to be on top of the list.
@@ -463,6 +635,86 @@ class Group(list):
             # Trigger modified only once with the last record
             self.record_modified()
 
+    def prefetch(self, start, end, direction):
+        """Load in background the records after the rows from start to end
+        in the direction of the scroll"""
+        if not self.fields or not self.__len__():
+            return
+        limit = CONFIG['client.limit']
+        if direction < 0:
+            records = reversed(self[max(start - limit, 0):start])
+        else:
+            records = self[end + 1:end + 1 + limit]
+        # Some fields may be loaded alone so all the eager fields are tested
+        names = frozenset(n for n, f in self.fields.items()
+            if f.attrs.get('loading', 'eager') == 'eager')
+        records = [r for r in records
+            if not r.destroyed
+            and r.id >= 0
+            and not names <= r._loaded
+            and r.id not in self.__prefetching]
+        if not records:
+            return
+        # The fields to read are those missing on the records to load
+        record = records[0]
+        _, _, fnames = record._get_load_fields('*')
+        limit //= min(len(fnames), 10)
+        id2record = {r.id: r for r in records[:limit]}
+        self.__prefetching.update(id2record)
+
+        def callback(values):
+            self.__prefetching.difference_update(id2record)
+            try:
+                values = values()
+            except RPCException:
+                return
+            # Skip the records loaded in the meantime
+            Record._set_loaded({
+                    id_: r for id_, r in id2record.items()
+                    if not names <= r._loaded}, values)
+        ctx = record._get_load_context(fnames, record.get_context())
+        RPCExecute('model', self.model_name, 'read', list(id2record),
+            fnames, context=ctx, process_exception=False,
+            priority=RPCProgress.PRIORITY_BACKGROUND, callback=callback)
+
+    def fetch(self, names, callback=None):
+        "Load asynchronously only the fields names of the records"
+        names = frozenset(n for n in names if n in self.fields)
+        # Fetch only once the same records to not loop on missing values
+        fetching = self.__fetching.setdefault(names, set())
+        records = [r for r in self
+            if not r.destroyed
+            and r.id >= 0
+            and not names <= r._loaded
+            and r.id not in fetching]
+        if not records:
+            return
+
+        def process(id2record, values):
+            try:
+                values = values()
+            except RPCException:
+                return
+            for value in values:
+                record = id2record[value['id']]
+                # Keep the values loaded or modified in the meantime
+                for name in (record._loaded | set(record.modified_fields)):
+                    value.pop(name, None)
+            Record._set_loaded(id2record, values)
+            # Allow to fetch again the records reloaded later
+            fetching.difference_update(
+                id_ for id_, r in id2record.items() if names <= r._loaded)
+            if callback:
+                callback()
+        limit = CONFIG['client.limit']
+        for i in range(0, len(records), limit):
+            id2record = {r.id: r for r in records[i:i + limit]}
+            fetching.update(id2record)
+            RPCExecute('model', self.model_name, 'read', list(id2record),
+                list(names), context=self.context, process_exception=False,
+                priority=RPCProgress.PRIORITY_BACKGROUND,
+                callback=partial(process, id2record))
+
     def get(self, id):
         'Return record with the id'
         return self.__id2record.get(id)
@@ -474,6 +726,9 @@ class Group(list):
         del self.__id2record[old_id]
 
     def destroy(self):
+        # The group is only discarded with its parent record, otherwise the
+        # screen is destroyed but the parent still holds the records
+        discarded = self.parent is None or self.parent.destroyed
         if self.parent:
             try:
                 self.parent.group.children.remove(self)
@@ -484,6 +739,27 @@ class Group(list):
         # parent otherwise it will trigger unnecessary display.
         self.screens.clear()
         self.parent = None
+        if discarded:
+            # Release the binary contents without waiting for the garbage
+            # collector
+            self._release_binaries()
+
+    def _release_binaries(self):
+        binaries, o2ms = [], []
+        for field in self.fields.values():
+            if isinstance(field, BinaryField):
+                binaries.append(field)
+            elif isinstance(field, O2MField):
+                o2ms.append(field.name)
+        if not binaries and not o2ms:
+            return
+        for record in chain(self, self.record_removed, self.record_deleted):
+            for field in binaries:
+                field.release(record)
+            for name in o2ms:
+                group = record.value.get(name)
+                if group is not None:
+                    group._release_binaries()
 
     def get_by_path(self, path):
         'return record by path'
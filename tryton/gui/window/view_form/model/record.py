@@ -1,31 +1,154 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import bisect
 import logging
 
 import tryton.common as common
 from tryton.common import RPCException, RPCExecute
 from tryton.config import CONFIG
-from tryton.pyson import PYSONDecoder
+from tryton.pyson import compile_pyson
 
 from . import field as fields
 
 logger = logging.getLogger(__name__)
 
 
+class _Values(dict):
+    "Values of a record invalidating the evaluations which read them"
+    __slots__ = ('record', 'evaluations', 'depends', 'version', 'reset',
+        'versions')
+
+    def __init__(self, record):
+        super().__init__()
+        self.record = record
+        self.evaluations = {}
+        self.depends = {}
+        self.version = 0
+        # The version of the last write of all the names
+        self.reset = 0
+        self.versions = {}
+
+    def __setitem__(self, key, value):
+        # The version of each name is kept only once it has been loaded
+        name = key if key in self else None
+        super().__setitem__(key, value)
+        self.invalidate(name)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.invalidate(key)
+
+    def pop(self, key, *args):
+        self.invalidate(key)
+        return super().pop(key, *args)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.invalidate()
+        return super().setdefault(key, default)
+
+    def memoize(self, expr, names, value):
+        self.evaluations[expr] = value
+        for name in names:
+            self.depends.setdefault(name, set()).add(expr)
+
+    def invalidate(self, name=None):
+        self.version += 1
+        if name is None:
+            self.evaluations.clear()
+            self.depends.clear()
+            self.versions.clear()
+            self.reset = self.version
+        else:
+            self.versions[name] = self.version
+            for expr in self.depends.pop(name, ()):
+                self.evaluations.pop(expr, None)
+        if self.record.group is not None:
+            self.record.group.record_value_changed(self.record)
+
+    def get_version(self, names):
+        "Return the version of the last write of one of the names"
+        versions = self.versions
+        return max([self.reset] + [versions.get(n, 0) for n in names])
+
+    def changed_since(self, version):
+        "Return the names written after version or None for all"
+        if self.reset > version:
+            return None
+        return {n for n, v in self.versions.items() if v > version}
+
+
+_LOADED = {}
+
+
+def _add_loaded(loaded, name):
+    "Return the loaded names with name shared between the records"
+    key = loaded, name
+    try:
+        return _LOADED[key]
+    except KeyError:
+        if len(_LOADED) >= 4096:
+            _LOADED.clear()
+        result = _LOADED[key] = loaded | {name}
+        return result
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+class _Groups:
+    "Read-only sequence of the records of consecutive groups"
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.offsets = [0]
+        for group in groups:
+            self.offsets.append(self.offsets[-1] + len(group))
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getitem__(self, idx):
+        i = bisect.bisect_right(self.offsets, idx) - 1
+        return self.groups[i][idx - self.offsets[i]]
+
+    def index(self, record):
+        for group, offset in zip(self.groups, self.offsets):
+            if group is record.group:
+                return offset + group.index(record)
+        raise ValueError('%r is not in groups' % record)
+
+    def __contains__(self, record):
+        try:
+            self.index(record)
+        except ValueError:
+            return False
+        return True
+
+
 class Record:
+    __slots__ = ('model_name', 'id', '_loaded', 'group', 'state_attrs',
+        'modified_fields', '_timestamp', '_write', '_delete', 'resources',
+        'button_clicks', 'links_counts', 'next', 'value', 'autocompletion',
+        'exception', 'destroyed', '__weakref__')
 
-    id = -1
+    _new_id = -1
 
     def __init__(self, model_name, obj_id, group=None):
         super(Record, self).__init__()
         self.model_name = model_name
         if obj_id is None:
-            self.id = Record.id
+            self.id = Record._new_id
         else:
             self.id = obj_id
         if self.id < 0:
-            Record.id -= 1
-        self._loaded = set()
+            Record._new_id -= 1
+        self._loaded = frozenset()
         self.group = group
         if group is not None:
             assert model_name == group.model_name
@@ -38,7 +161,7 @@ class Record:
         self.button_clicks = {}
         self.links_counts = {}
         self.next = {}  # Used in Group list
-        self.value = {}
+        self.value = _Values(self)
         self.autocompletion = {}
         self.exception = False
         self.destroyed = False
@@ -48,47 +171,18 @@ class Record:
             id2record = {
                 self.id: self,
                 }
-            if name == '*':
-                loading = 'eager'
-                views = set()
-                for field in self.group.fields.values():
-                    if field.attrs.get('loading', 'eager') == 'lazy':
-                        loading = 'lazy'
-                    views |= field.views
-                # Set a valid name for next loaded check
-                for fname, field in self.group.fields.items():
-                    if field.attrs.get('loading', 'eager') == loading:
-                        name = fname
-                        break
-            else:
-                loading = self.group.fields[name].attrs.get('loading', 'eager')
-                views = self.group.fields[name].views
-
-            if loading == 'eager':
-                fields = ((fname, field)
-                    for fname, field in self.group.fields.items()
-                    if field.attrs.get('loading', 'eager') == 'eager')
-            else:
-                fields = self.group.fields.items()
-
-            fnames = [fname for fname, field in fields
-                if fname not in self._loaded
-                and (not views or (views & field.views))]
-            fnames.extend(('%s.rec_name' % fname for fname in fnames[:]
-                    if self.group.fields[fname].attrs['type']
-                    in ('many2one', 'one2one', 'reference')))
-            if 'rec_name' not in fnames:
-                fnames.append('rec_name')
-            fnames.extend(['_timestamp', '_write', '_delete'])
+            name, loading, fnames = self._get_load_fields(name)
 
             record_context = self.get_context()
             if loading == 'eager':
                 limit = CONFIG['client.limit'] // min(len(fnames), 10)
+                # Test all the names as some fields may be loaded alone
+                names = self.group.fields.keys() & set(fnames)
 
                 def filter_group(record):
                     return (not record.destroyed
                         and record.id >= 0
-                        and name not in record._loaded)
+                        and not names <= record._loaded)
 
                 def filter_parent_group(record):
                     return (filter_group(record)
@@ -98,7 +192,7 @@ class Record:
                             or (record.get_context() == record_context)))
 
                 if self.parent and self.parent.model_name == self.model_name:
-                    group = sum(self.parent.group.children, [])
+                    group = _Groups(self.parent.group.children)
                     filter_ = filter_parent_group
                 else:
                     group = self.group
@@ -119,10 +213,7 @@ class Record:
                                 id2record[record.id] = record
                         n += 1
 
-            ctx = record_context.copy()
-            ctx.update(dict(('%s.%s' % (self.model_name, fname), 'size')
-                    for fname, field in self.group.fields.items()
-                    if field.attrs['type'] == 'binary' and fname in fnames))
+            ctx = self._get_load_context(fnames, record_context)
             exception = False
             try:
                 values = RPCExecute('model', self.model_name, 'read',
@@ -133,18 +224,65 @@ class Record:
                 for value in values:
                     value.update(default_values)
                 self.exception = exception = True
-            id2value = dict((value['id'], value) for value in values)
-            for id, record in id2record.items():
-                if not record.exception:
-                    record.exception = exception
-                value = id2value.get(id)
-                if record and not record.destroyed and value:
-                    for key in record.modified_fields:
-                        value.pop(key, None)
-                    record.set(value, modified=False)
+            self._set_loaded(id2record, values, exception)
         if name != '*':
             return self.group.fields[name]
 
+    def _get_load_fields(self, name):
+        "Return the name to test, the loading and the field names to read"
+        if name == '*':
+            loading = 'eager'
+            views = set()
+            for field in self.group.fields.values():
+                if field.attrs.get('loading', 'eager') == 'lazy':
+                    loading = 'lazy'
+                views |= field.views
+            # Set a valid name for next loaded check
+            for fname, field in self.group.fields.items():
+                if field.attrs.get('loading', 'eager') == loading:
+                    name = fname
+                    break
+        else:
+            loading = self.group.fields[name].attrs.get('loading', 'eager')
+            views = self.group.fields[name].views
+
+        if loading == 'eager':
+            fields = ((fname, field)
+                for fname, field in self.group.fields.items()
+                if field.attrs.get('loading', 'eager') == 'eager')
+        else:
+            fields = self.group.fields.items()
+
+        fnames = [fname for fname, field in fields
+            if fname not in self._loaded
+            and (not views or (views & field.views))]
+        fnames.extend(('%s.rec_name' % fname for fname in fnames[:]
+                if self.group.fields[fname].attrs['type']
+                in ('many2one', 'one2one', 'reference')))
+        if 'rec_name' not in fnames:
+            fnames.append('rec_name')
+        fnames.extend(['_timestamp', '_write', '_delete'])
+        return name, loading, fnames
+
+    def _get_load_context(self, fnames, context):
+        ctx = context.copy()
+        ctx.update(dict(('%s.%s' % (self.model_name, fname), 'size')
+                for fname, field in self.group.fields.items()
+                if field.attrs['type'] == 'binary' and fname in fnames))
+        return ctx
+
+    @staticmethod
+    def _set_loaded(id2record, values, exception=False):
+        id2value = dict((value['id'], value) for value in values)
+        for id, record in id2record.items():
+            if not record.exception:
+                record.exception = exception
+            value = id2value.get(id)
+            if record and not record.destroyed and value:
+                for key in record.modified_fields:
+                    value.pop(key, None)
+                record.set(value, modified=False)
+
     def __repr__(self):
         return '<Record %s@%s at %s>' % (self.id, self.model_name, id(self))
 
@@ -307,7 +445,8 @@ class Record:
         return value
 
     def cancel(self):
-        self._loaded.clear()
+        self._loaded = frozenset()
+        self.value.invalidate()
         self.modified_fields.clear()
         self._timestamp = None
         self.button_clicks.clear()
@@ -439,7 +578,7 @@ class Record:
                 related = fieldname + '.'
                 self.value[related] = val.get(related) or {}
             self.group.fields[fieldname].set_default(self, value)
-            self._loaded.add(fieldname)
+            self._loaded = _add_loaded(self._loaded, fieldname)
             fieldnames.append(fieldname)
         self.on_change(fieldnames)
         self.on_change_with(fieldnames)
@@ -472,11 +611,11 @@ class Record:
                 related = fieldname + '.'
                 self.value[related] = val.get(related) or {}
             self.group.fields[fieldname].set(self, value)
-            self._loaded.add(fieldname)
+            self._loaded = _add_loaded(self._loaded, fieldname)
             fieldnames.append(fieldname)
         for fieldname, value in later.items():
             self.group.fields[fieldname].set(self, value)
-            self._loaded.add(fieldname)
+            self._loaded = _add_loaded(self._loaded, fieldname)
         if validate:
             self.validate(fieldnames, softvalidation=True)
         if modified:
@@ -522,15 +661,45 @@ class Record:
             return []
         elif expr == '{}':
             return {}
-        ctx = self.get_eval()
-        ctx['context'] = self.get_context()
+        evaluate = compile_pyson(expr)
+        memoize = self._memoize_eval(evaluate.names)
+        if memoize:
+            id_, value = self.value.evaluations.get(expr, (None, None))
+            if id_ == self.id:
+                return _copy(value)
+        ctx = common.EvalEnvironment(self)
+        if evaluate.names is None or 'context' in evaluate.names:
+            ctx['context'] = self.get_context()
         ctx['active_model'] = self.model_name
         ctx['active_id'] = self.id
-        if self.parent and self.parent_name:
-            ctx['_parent_' + self.parent_name] = \
-                common.EvalEnvironment(self.parent)
-        val = PYSONDecoder(ctx).decode(expr)
-        return val
+        value = evaluate(ctx)
+        if memoize:
+            self.value.memoize(expr, evaluate.names, (self.id, value))
+            value = _copy(value)
+        return value
+
+    def get_version(self, depends):
+        "Return the version of the values evaluated by depends"
+        names, parent_names = depends
+        parent_version = None
+        if parent_names and self.parent:
+            parent_version = self.parent.value.get_version(parent_names)
+        # The groups of x2many are modified in place
+        x2many = [self.group.fields[n].get_eval(self) for n in names
+            if isinstance(self.group.fields.get(n), fields.O2MField)]
+        return (self.id, self.value.get_version(names), parent_version,
+            x2many)
+
+    def _memoize_eval(self, names):
+        "Test if the evaluation of names depends only on the values"
+        if names is None:
+            return False
+        for name in names:
+            if name == 'context' or name.startswith('_parent_'):
+                return False
+            if isinstance(self.group.fields.get(name), fields.O2MField):
+                return False
+        return True
 
     def _get_on_change_args(self, args):
         res = {}
@@ -692,7 +861,7 @@ class Record:
         self.group.record_modified()
 
     def destroy(self):
+        self.destroyed = True
         for v in self.value.values():
             if hasattr(v, 'destroy'):
                 v.destroy()
-        self.destroyed = True
@@ -16,10 +16,11 @@ from gi.repository import GLib, Gtk
 
 from tryton.action import Action
 from tryton.common import (
-    MODELACCESS, RPCContextReload, RPCException, RPCExecute, node_attributes,
-    sur, warning)
+    MODELACCESS, RPCContextReload, RPCException, RPCExecute, RPCExecuteMulti,
+    RPCProgress, node_attributes, sur, warning)
 from tryton.common.domain_parser import DomainParser
 from tryton.config import CONFIG
+from tryton.exceptions import TrytonServerError
 from tryton.gui.window.infobar import InfoBar
 from tryton.gui.window.view_form.model.group import Group
 from tryton.gui.window.view_form.view import View
@@ -51,6 +52,10 @@ class Screen:
                 or MODELACCESS[model_name]['create']):
             self.readonly = True
         self.search_count = 0
+        # The generation of the last count requested for each tab index
+        self._tab_counters = {}
+        self._tab_counting = {}
+        self._tab_generation = 0
         if not attributes.get('row_activate'):
             self.row_activate = self.default_row_activate
         else:
@@ -366,24 +371,50 @@ class Screen:
         return domain
 
     def count_tab_domain(self, current=False):
-        def set_tab_counter(count, idx):
+        def set_tab_counters(counts, indexes, generation):
+            self._tab_counting.pop(generation, None)
             try:
-                count = count()
+                counts = counts()
             except RPCException:
-                count = None
-            self.screen_container.set_tab_counter(count, idx)
+                counts = [lambda: None] * len(indexes)
+            for idx, count in zip(indexes, counts):
+                # Ignore the results superseded by a newer count
+                if self._tab_counters.get(idx) != generation:
+                    continue
+                try:
+                    count = count()
+                except TrytonServerError:
+                    count = None
+                self.screen_container.set_tab_counter(count, idx)
         screen_domain = self.search_domain(
             self.screen_container.get_text(), with_tab=False)
         index = self.screen_container.get_tab_index()
+        calls, indexes = [], []
         for idx, (name, domain, count) in enumerate(
                 self.screen_container.tab_domain):
             if not count or (current and idx != index):
                 continue
             domain = ['AND', domain, screen_domain]
-            set_tab_counter(lambda: None, idx)
-            RPCExecute('model', self.model_name,
-                'search_count', domain, 0, 1000, context=self.context,
-                callback=functools.partial(set_tab_counter, idx=idx))
+            self.screen_container.set_tab_counter(None, idx)
+            calls.append(
+                ('model', self.model_name, 'search_count', domain, 0, 1000))
+            indexes.append(idx)
+        if not calls:
+            return
+        self._tab_generation += 1
+        generation = self._tab_generation
+        for idx in indexes:
+            self._tab_counters[idx] = generation
+        # Cancel the previous counts which are superseded for all their tabs
+        pending = set(self._tab_counters.values())
+        for previous in list(self._tab_counting):
+            if previous not in pending:
+                self._tab_counting.pop(previous).cancel()
+        self._tab_counting[generation] = RPCExecuteMulti(
+            *calls, context=self.context,
+            priority=RPCProgress.PRIORITY_BACKGROUND,
+            callback=functools.partial(
+                set_tab_counters, indexes=indexes, generation=generation))
 
     @property
     def context(self):
@@ -4,6 +4,7 @@ import gettext
 from collections import defaultdict
 
 from tryton.common import node_attributes
+from tryton.pyson import get_eval_depends
 
 _ = gettext.gettext
 list_ = list  # list builtins is overridden by import .list
@@ -26,6 +27,9 @@ class View(object):
         self.screen = screen
         self.widgets = defaultdict(list_)
         self.state_widgets = []
+        self._state_depends = {}
+        self._state_stamp = None
+        self._state_version = 0
         self.attributes = node_attributes(xml)
         screen.set_on_write(self.attributes.get('on_write'))
 
@@ -60,6 +64,36 @@ class View(object):
     def get_buttons(self):
         raise NotImplementedError
 
+    def states_changed(self, record):
+        "Return a function testing if the states of a field may have changed"
+        stamp = (record, record.id, record.readonly, record.group.readonly)
+        if stamp != self._state_stamp:
+            changed = None
+        else:
+            changed = record.value.changed_since(self._state_version)
+        self._state_stamp = stamp
+        self._state_version = record.value.version
+
+        def test(field):
+            if changed is None:
+                return True
+            if field.name not in self._state_depends:
+                # The validation of the domain may force readonly
+                self._state_depends[field.name] = get_eval_depends(
+                    field.attrs.get('states'), field.attrs.get('domain'))
+            depends = self._state_depends[field.name]
+            if depends is None:
+                return True
+            names, parent_names = depends
+            if parent_names or field.name in changed or names & changed:
+                return True
+            # The groups of x2many are modified in place
+            return any(
+                record.group.fields[n].attrs['type'] in {
+                    'one2many', 'many2many'}
+                for n in names if n in record.group.fields)
+        return test
+
     @staticmethod
     def parse(screen, view_id, view_type, xml, children_field):
         from .calendar_ import ViewCalendar
@@ -530,11 +530,13 @@ class ViewForm(View):
             for field, _, _ in fields:
                 record[field].get(record)
         focused_widget = find_focused_child(self.widget)
+        if record:
+            changed = self.states_changed(record)
         for name, widgets in self.widgets.items():
             field = None
             if record:
                 field = record.group.fields.get(name)
-            if field:
+            if field and changed(field):
                 field.state_set(record)
             for widget in widgets:
                 widget.display()
@@ -108,6 +108,11 @@ class BinaryMixin(Widget):
                 os.path.basename(urlparse(uri).path))
 
     def get_data(self):
+        if hasattr(self.field, 'get_blob'):
+            blob = self.field.get_blob(self.record)
+            if blob is not None:
+                # Write the content without copying it
+                return blob.view()
         if hasattr(self.field, 'get_data'):
             data = self.field.get_data(self.record)
         else:
@@ -57,6 +57,7 @@ class VBox(StateMixin, Gtk.VBox):
 
 
 class Image(StateMixin, Gtk.Image):
+    url = None
 
     def state_set(self, record):
         super(Image, self).state_set(record)
@@ -68,12 +69,19 @@ class Image(StateMixin, Gtk.Image):
             name = field.get(record)
         size = int(self.attrs.get('size', 48))
         if self.attrs.get('type') == 'url':
+            self.url = name, size
             pixbuf = common.IconFactory.get_pixbuf_url(
-                name, size=size, size_param=self.attrs.get('url_size'))
+                name, size=size, size_param=self.attrs.get('url_size'),
+                callback=self.url_loaded)
         else:
             pixbuf = common.IconFactory.get_pixbuf(name, size)
         self.set_from_pixbuf(pixbuf)
 
+    def url_loaded(self):
+        name, size = self.url
+        self.set_from_pixbuf(common.IconFactory.get_pixbuf_url(
+                name, size=size, size_param=self.attrs.get('url_size')))
+
 
 class Frame(StateMixin, Gtk.Frame):
 
@@ -185,6 +193,7 @@ class Link(StateMixin, Gtk.Button):
                     common.RPCExecute(
                         'model', action['res_model'], 'search_count',
                         ['AND', domain, tab_domain], 0, 100, context=context,
+                        priority=common.RPCProgress.PRIORITY_BACKGROUND,
                         callback=functools.partial(
                             self._set_count, idx=i, current=self._current,
                             counter=counter, label=label))
@@ -192,6 +201,7 @@ class Link(StateMixin, Gtk.Button):
                 common.RPCExecute(
                     'model', action['res_model'], 'search_count',
                     domain, 0, 100, context=context,
+                    priority=common.RPCProgress.PRIORITY_BACKGROUND,
                     callback=functools.partial(
                         self._set_count, current=self._current,
                         counter=counter, label=label))
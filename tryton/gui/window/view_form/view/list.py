@@ -17,7 +17,7 @@ from tryton.common.cellrendererbutton import CellRendererButton
 from tryton.common.popup_menu import populate, popup
 from tryton.config import CONFIG
 from tryton.gui.window import Window
-from tryton.pyson import PYSONDecoder
+from tryton.pyson import PYSONDecoder, get_eval_depends
 
 from . import View, XMLViewParser
 from .list_gtk.editabletree import EditableTreeView, TreeView
@@ -348,7 +348,12 @@ class TreeXMLViewParser(XMLViewParser):
             self.view.sum_box.pack_start(
                 hbox, expand=False, fill=False, padding=0)
 
-            self.view.sum_widgets.append((attributes['name'], sum_))
+            # The server validates the view against its schema so the
+            # aggregate attribute can be used only if the schema allows it,
+            # otherwise the whole view is rejected
+            self.view.sum_widgets.append(
+                (attributes['name'], sum_,
+                    attributes.get('aggregate', 'sum')))
 
     def _parse_button(self, node, attributes):
         button = Button(self.view, attributes)
@@ -479,6 +484,8 @@ class ViewTree(View):
         scroll.set_policy(
             Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
         scroll.set_placement(Gtk.CornerType.TOP_LEFT)
+        self._scroll_value = 0
+        scroll.get_vadjustment().connect('value-changed', self._prefetch)
         viewport = Gtk.Viewport()
         viewport.set_shadow_type(Gtk.ShadowType.ETCHED_IN)
         viewport.add(scroll)
@@ -519,6 +526,19 @@ class ViewTree(View):
             column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
             self.treeview.append_column(column)
 
+    def _prefetch(self, adjustment):
+        "Load the records following the visible rows in the scroll direction"
+        value = adjustment.get_value()
+        direction = value - self._scroll_value
+        self._scroll_value = value
+        visible_range = self.treeview.get_visible_range()
+        model = self.treeview.get_model()
+        if not visible_range or not model:
+            return
+        start, end = visible_range
+        model.group.prefetch(
+            start.get_indices()[0], end.get_indices()[0], direction)
+
     def optional_menu(self, column):
         def toggle(menuitem, column):
             column.set_visible(menuitem.get_active())
@@ -1091,6 +1111,7 @@ class ViewTree(View):
         if (force
                 or not self.treeview.get_model()
                 or self.group != self.treeview.get_model().group):
+            self.treeview.refresh_counter += 1
             model = AdaptModelGroup(self.group, self.children_field)
             self.treeview.set_model(model)
             # __select_changed resets current_record to None
@@ -1153,62 +1174,58 @@ class ViewTree(View):
     def set_state(self):
         record = self.record
         if record:
+            changed = self.states_changed(record)
             for field in record.group.fields:
                 field = record.group.fields.get(field, None)
-                if field:
+                if field and changed(field):
                     field.state_set(record)
 
     @delay
     def update_sum(self):
         selected_records = self.selected_records
-        for name, label in self.sum_widgets:
-            sum_ = None
-            selected_sum = None
-            loaded = True
-            digit = 0
+        unloaded = set()
+        for name, label, aggregate in self.sum_widgets:
             field = self.group.fields[name]
-            for record in self.group:
-                if not record.get_loaded([name]) and record.id >= 0:
-                    loaded = False
-                    break
-                value = field.get(record)
-                if value is not None:
-                    if sum_ is None:
-                        sum_ = value
-                    else:
-                        sum_ += value
-                    if record in selected_records or not selected_records:
-                        if selected_sum is None:
-                            selected_sum = value
-                        else:
-                            selected_sum += value
-                    if hasattr(field, 'digits'):
-                        fdigits = field.digits(record)
-                        if fdigits and digit is not None:
-                            digit = max(fdigits[1], digit)
-                        else:
-                            digit = None
-
-            if loaded:
-                if field.attrs['type'] == 'timedelta':
-                    converter = field.converter(self.group)
-                    selected_sum = common.timedelta.format(
-                        selected_sum, converter)
-                    sum_ = common.timedelta.format(sum_, converter)
-                elif digit is not None:
-                    selected_sum = locale.localize(
-                        '{0:.{1}f}'.format(selected_sum or 0, digit), True)
-                    sum_ = locale.localize(
-                        '{0:.{1}f}'.format(sum_ or 0, digit), True)
-                else:
-                    selected_sum = locale.localize(
-                        '{}'.format(selected_sum or 0), True)
-                    sum_ = locale.localize('{}'.format(sum_ or 0), True)
-
-                text = '%s / %s' % (selected_sum, sum_)
+            total = self.group.get_aggregate(name)
+            if total is None:
+                label.set_text('-')
+                unloaded.add(name)
+                continue
+            if selected_records:
+                selected = self.group.get_aggregate(name, selected_records)
             else:
-                text = '-'
-            label.set_text(text)
+                selected = total
+            label.set_text('%s / %s' % (
+                    self._format_aggregate(field, aggregate, selected),
+                    self._format_aggregate(field, aggregate, total)))
+        if unloaded:
+            # Read only the summed fields instead of waiting for the
+            # records to be loaded
+            names = set(unloaded)
+            for name in unloaded:
+                digits = self.group.fields[name].attrs.get('digits')
+                depends = get_eval_depends(digits)
+                if depends:
+                    names.update(depends[0])
+                if isinstance(digits, str):
+                    digits = json.loads(digits)
+                    # The digits are read from the field with this name
+                    if isinstance(digits, str):
+                        names.add(digits)
+            self.group.fetch(names, callback=self.update_sum)
+
+    def _format_aggregate(self, field, aggregate, values):
+        value, digit = values[aggregate], values['digits']
+        if aggregate == 'count':
+            return locale.localize('{}'.format(value), True)
+        elif field.attrs['type'] == 'timedelta':
+            converter = field.converter(self.group)
+            return common.timedelta.format(value, converter)
+        elif digit is not None:
+            return locale.localize(
+                '{0:.{1}f}'.format(value or 0, digit), True)
+        else:
+            return locale.localize('{}'.format(value or 0), True)
 
     def set_cursor(self, new=False, reset_view=True):
         self.treeview.grab_focus()
@@ -25,6 +25,7 @@ def focusable_cells(column, editable=True):
 
 class TreeView(Gtk.TreeView):
     display_counter = 0
+    refresh_counter = 0
 
     def __init__(self, view):
         super(TreeView, self).__init__()
@@ -162,6 +163,7 @@ class EditableTreeView(TreeView):
         model = self.get_model()
         record = model.get_value(model.get_iter(path), 0)
         self.display_counter += 1  # Force a display
+        self.refresh_counter += 1
 
         leaving = False
         if event.keyval == Gdk.KEY_Right:
@@ -2,15 +2,20 @@
 # this repository contains the full copyright notices and license terms.
 import datetime
 import gettext
+import json
 import os
 import webbrowser
+from collections import OrderedDict
 from functools import partial, wraps
-from weakref import WeakKeyDictionary
+from threading import Thread
+from weakref import WeakKeyDictionary, ref
 
 from gi.repository import Gdk, GLib, Gtk
 
 import tryton.common as common
-from tryton.common import data2pixbuf, file_open, file_selection, file_write
+from tryton.common import (
+    RPCException, RPCExecute, RPCProgress, data2pixbuf, file_open,
+    file_selection, file_write)
 from tryton.common.cellrendererbutton import CellRendererButton
 from tryton.common.cellrendererclickablepixbuf import (
     CellRendererClickablePixbuf)
@@ -25,10 +30,12 @@ from tryton.common.datetime_ import CellRendererDate, CellRendererTime
 from tryton.common.domain_parser import quote
 from tryton.common.selection import (
     PopdownMixin, SelectionMixin, selection_shortcuts)
+from tryton.common.thumbnail import THUMBNAILS
 from tryton.config import CONFIG
 from tryton.gui.window.view_form.screen import Screen
 from tryton.gui.window.win_form import WinForm
 from tryton.gui.window.win_search import WinSearch
+from tryton.pyson import get_eval_depends
 
 _ = gettext.gettext
 
@@ -72,6 +79,8 @@ _REALIZED = WeakKeyDictionary()
 class CellCache(list):
 
     methods = ('set_active', 'set_sensitive', 'set_property')
+    # The number of records for which a cell is cached
+    size = 1024
 
     def apply(self, cell):
         for method, args, kwargs in self:
@@ -102,13 +111,16 @@ class CellCache(list):
     def cache(cls, func):
         @wraps(func)
         def wrapper(self, column, cell, store, iter_, user_data=None):
-            if not hasattr(self, 'display_counters'):
-                self.display_counters = {}
             if not hasattr(self, 'cell_caches'):
-                self.cell_caches = {}
+                self.cell_caches = OrderedDict()
             record = store.get_value(iter_, 0)
-            counter = self.view.treeview.display_counter
-            if (self.display_counters.get(record.id) != counter):
+            # Key by id with a weak reference to not keep the records alive
+            key = id(record)
+            record_ref, stamp, cache = self.cell_caches.get(
+                key, (None, None, None))
+            if (cache is None
+                    or record_ref() is not record
+                    or stamp != self.get_display_stamp(record)):
                 if getattr(cell, 'decorated', None):
                     func(self, column, cell, store, iter_, user_data)
                 else:
@@ -116,10 +128,16 @@ class CellCache(list):
                     cache.decorate(cell)
                     func(self, column, cell, store, iter_, user_data)
                     cache.undecorate(cell)
-                    self.cell_caches[record.id] = cache
-                    self.display_counters[record.id] = counter
+                    # The rendering may have loaded the record
+                    self.cell_caches[key] = (
+                        ref(record), self.get_display_stamp(record),
+                        cache)
+                    self.cell_caches.move_to_end(key)
+                    while len(self.cell_caches) > cls.size:
+                        self.cell_caches.popitem(last=False)
             else:
-                self.cell_caches[record.id].apply(cell)
+                self.cell_caches.move_to_end(key)
+                cache.apply(cell)
         return wrapper
 
 
@@ -131,6 +149,52 @@ class Cell(object):
     view = None
     prefixes = []
     suffixes = []
+    _depends = ()
+
+    @property
+    def depends(self):
+        "The field names and parent field names rendered or None if unknown"
+        if self._depends == ():
+            self._depends = self._get_depends()
+        return self._depends
+
+    @property
+    def field_attrs(self):
+        "The attributes of the field of the model"
+        field = self.view.screen.group.fields.get(self.attrs.get('name'))
+        return field.attrs if field else {}
+
+    def _get_depends(self):
+        digits = self.field_attrs.get('digits')
+        depends = get_eval_depends(
+            self.attrs.get('states'), self.attrs.get('domain'),
+            self.attrs.get('visual'), self.view.attributes.get('visual'),
+            digits)
+        if depends is None:
+            return
+        names, parent_names = depends
+        for name in ['name', 'symbol', 'filename']:
+            if self.attrs.get(name):
+                names |= {self.attrs[name], self.attrs[name] + '.'}
+        names |= set(self.attrs.get('selection_change_with') or [])
+        if isinstance(digits, str):
+            digits = json.loads(digits)
+            if isinstance(digits, dict):
+                # A PYSON statement may return the name of a field
+                return
+            elif isinstance(digits, str):
+                # The digits are read from the field with this name
+                names |= {digits}
+        return names, parent_names
+
+    def get_display_stamp(self, record):
+        "Return the stamp which changes when the cell must be rendered"
+        treeview = self.view.treeview
+        if self.depends is None:
+            return treeview.display_counter
+        return (treeview.refresh_counter, record.get_version(self.depends),
+            record.deleted, record.removed, record.readonly,
+            record.group.readonly)
 
     def _get_record_field_from_path(self, path, store=None):
         if not store:
@@ -180,6 +244,19 @@ class Affix(Cell):
             self.renderer = Gtk.CellRendererText()
         self.view = view
 
+    def _get_depends(self):
+        depends = super()._get_depends()
+        # The invisible state comes from the field
+        states = get_eval_depends(self.field_attrs.get('states'))
+        if depends is None or states is None:
+            return
+        names, parent_names = depends
+        names |= states[0]
+        parent_names |= states[1]
+        if self.icon:
+            names |= {self.icon}
+        return names, parent_names
+
     @realized
     @CellCache.cache
     def setter(self, column, cell, store, iter_, user_data=None):
@@ -195,7 +272,8 @@ class Affix(Cell):
                 value = self.icon
             if self.attrs.get('icon_type') == 'url':
                 pixbuf = common.IconFactory.get_pixbuf_url(
-                    value, size_param=self.attrs.get('url_size'))
+                    value, size_param=self.attrs.get('url_size'),
+                    callback=self.url_loaded)
             else:
                 pixbuf = common.IconFactory.get_pixbuf(
                     value, Gtk.IconSize.BUTTON)
@@ -207,6 +285,12 @@ class Affix(Cell):
             cell.set_property('text', text)
         self._set_visual(cell, record)
 
+    def url_loaded(self):
+        # The cached cells do not depend on the loading of the icons
+        treeview = self.view.treeview
+        treeview.refresh_counter += 1
+        treeview.queue_draw()
+
     def clicked(self, renderer, path):
         record, field = self._get_record_field_from_path(path)
         value = record[self.attrs['name']].get(record)
@@ -578,6 +662,11 @@ class Binary(GenericText):
         self._set_visual(cell, record)
 
     def get_data(self, record, field):
+        if hasattr(field, 'get_blob'):
+            blob = field.get_blob(record)
+            if blob is not None:
+                # Write the content without copying it
+                return blob.view()
         if hasattr(field, 'get_data'):
             data = field.get_data(record)
         else:
@@ -726,6 +815,12 @@ class Image(GenericText):
         self.height = int(attrs.get('height', 100))
         self.width = int(attrs.get('width', 300))
         self.renderer.set_fixed_size(self.width, self.height)
+        self.thumbnails_queue = {}
+        self.thumbnails_fetching = set()
+
+    def get_display_stamp(self, record):
+        return (super().get_display_stamp(record),
+            self.get_thumbnail_key(record) in THUMBNAILS)
 
     @realized
     @CellCache.cache
@@ -734,15 +829,101 @@ class Image(GenericText):
         value = field.get_client(record)
         if isinstance(value, int):
             if value > CONFIG['image.max_size']:
-                value = None
+                pixbuf = None
             else:
-                value = field.get_data(record)
-        pixbuf = data2pixbuf(value)
-        if pixbuf:
-            pixbuf = common.resize_pixbuf(pixbuf, self.width, self.height)
+                pixbuf = self.get_thumbnail(record)
+        else:
+            pixbuf = data2pixbuf(value)
+            if pixbuf:
+                pixbuf = common.resize_pixbuf(
+                    pixbuf, self.width, self.height)
         cell.set_property('pixbuf', pixbuf)
         self._set_visual(cell, record)
 
+    def get_thumbnail_key(self, record):
+        name = self.attrs['name']
+        value = record.value.get(name)
+        if not isinstance(value, int):
+            return
+        return (record.model_name, record.id, name, record._timestamp, value,
+            self.width, self.height)
+
+    def get_thumbnail(self, record):
+        "Return the thumbnail or None until it is fetched"
+        key = self.get_thumbnail_key(record)
+        if key in THUMBNAILS:
+            return THUMBNAILS[key]
+        if (key not in self.thumbnails_queue
+                and key not in self.thumbnails_fetching):
+            if not self.thumbnails_queue:
+                GLib.idle_add(self.fetch_thumbnails)
+            self.thumbnails_queue[key] = record
+
+    def fetch_thumbnails(self):
+        "Load the queued thumbnails from the disk in a thread"
+        queue = {k: r for k, r in self.thumbnails_queue.items()
+            if not r.destroyed}
+        self.thumbnails_fetching.update(queue)
+        self.thumbnails_queue.clear()
+
+        def load():
+            thumbnails = {}
+            for key in queue:
+                pixbuf = THUMBNAILS.load(key)
+                if pixbuf:
+                    thumbnails[key] = pixbuf
+            GLib.idle_add(self.read_thumbnails, queue, thumbnails)
+        Thread(target=load, daemon=True).start()
+
+    def read_thumbnails(self, queue, thumbnails):
+        "Read the data of the missing thumbnails with one call per group"
+        self.set_thumbnails(thumbnails)
+        name = self.attrs['name']
+        groups = {}
+        for key, record in queue.items():
+            if key in thumbnails:
+                continue
+            group, keys = groups.setdefault(id(record.group), (
+                    record.group, {}))
+            keys[record.id] = key
+        for group, keys in groups.values():
+            RPCExecute(
+                'model', group.model_name, 'read', list(keys), [name],
+                context=group.context,
+                callback=partial(self.decode_thumbnails, keys),
+                priority=RPCProgress.PRIORITY_BACKGROUND,
+                process_exception=False)
+
+    def decode_thumbnails(self, keys, result):
+        "Decode the read thumbnails in a thread"
+        name = self.attrs['name']
+        try:
+            data = {v['id']: v[name] for v in result()}
+        except RPCException:
+            data = {}
+
+        def decode():
+            thumbnails = {}
+            for id_, key in keys.items():
+                value = data.get(id_)
+                if isinstance(value, str):
+                    value = value.encode('utf-8')
+                pixbuf = data2pixbuf(value)
+                if pixbuf:
+                    pixbuf = common.resize_pixbuf(
+                        pixbuf, self.width, self.height)
+                    THUMBNAILS.save(key, pixbuf)
+                thumbnails[key] = pixbuf
+            GLib.idle_add(self.set_thumbnails, thumbnails)
+        Thread(target=decode, daemon=True).start()
+
+    def set_thumbnails(self, thumbnails):
+        self.thumbnails_fetching.difference_update(thumbnails)
+        for key, pixbuf in thumbnails.items():
+            THUMBNAILS[key] = pixbuf
+        if thumbnails:
+            self.view.treeview.queue_draw()
+
     def get_textual_value(self, record):
         if not record:
             return ''
@@ -1280,6 +1461,10 @@ class Button(Cell):
         self.renderer.connect('clicked', self.button_clicked)
         self.renderer.set_property('yalign', 0)
 
+    def _get_depends(self):
+        # The sensitivity depends on the modification of the parents
+        return None
+
     @realized
     @CellCache.cache
     def setter(self, column, cell, store, iter_, user_data=None):
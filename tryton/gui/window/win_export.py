@@ -3,17 +3,23 @@
 import base64
 import csv
 import datetime
+import functools
 import gettext
 import json
 import locale
 import os
 import tempfile
 import urllib.parse
-from itertools import zip_longest
 from numbers import Number
 
 from gi.repository import Gdk, GObject, Gtk
 
+try:
+    import openpyxl
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+except ImportError:
+    openpyxl = None
+
 import tryton.common as common
 from tryton.common import RPCException, RPCExecute
 from tryton.config import CONFIG
@@ -24,6 +30,64 @@ from tryton.rpc import CONNECTION, clear_cache
 _ = gettext.gettext
 
 
+class CSVWriter(object):
+    "Write the exported rows as CSV"
+    name = 'CSV'
+    extension = 'csv'
+
+    def __init__(self, fname, window):
+        encoding = window.csv_enc.get_active_text() or 'utf_8_sig'
+        self.locale_format = window.csv_locale.get_active()
+        self.file = open(fname, 'w', encoding=encoding, newline='')
+        self.writer = csv.writer(
+            self.file,
+            quotechar=window.get_quotechar(),
+            delimiter=window.get_delimiter())
+
+    def writerow(self, row, indent=0):
+        self.writer.writerow(WinExport.format_row(
+                row, indent=indent, locale_format=self.locale_format))
+
+    def close(self):
+        self.file.close()
+
+
+class XLSXWriter(object):
+    "Write the exported rows as XLSX keeping their types"
+    name = 'XLSX'
+    extension = 'xlsx'
+    types = (
+        str, Number, datetime.date, datetime.time, datetime.timedelta)
+
+    def __init__(self, fname, window):
+        self.fname = fname
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+
+    def writerow(self, row, indent=0):
+        cells = []
+        for i, val in enumerate(row):
+            if isinstance(val, bytes):
+                val = base64.b64encode(val).decode('utf-8')
+            elif val is not None and not isinstance(val, self.types):
+                val = str(val)
+            if isinstance(val, str):
+                # openpyxl refuses the control characters
+                val = ILLEGAL_CHARACTERS_RE.sub('', val)
+                if i == 0 and indent:
+                    val = '  ' * indent + val
+            cells.append(val)
+        self.sheet.append(cells)
+
+    def close(self):
+        self.workbook.save(self.fname)
+
+
+WRITERS = [CSVWriter]
+if openpyxl:
+    WRITERS.append(XLSXWriter)
+
+
 class WinExport(WinCSV):
     "Window export"
 
@@ -35,6 +99,12 @@ class WinExport(WinCSV):
         self.dialog.set_title(_('CSV Export: %s') % name)
         # Hide as selected record is the default
         self.ignore_search_limit.hide()
+        self.progressbar = Gtk.ProgressBar(show_text=True)
+        self.progressbar.set_no_show_all(True)
+        self.dialog.vbox.pack_start(
+            self.progressbar, expand=False, fill=True, padding=3)
+        self.export_progress = None
+        self.export_writer = None
 
     @property
     def model(self):
@@ -135,6 +205,13 @@ class WinExport(WinCSV):
         hbox_csv_export.pack_start(
             self.ignore_search_limit, expand=False, fill=True, padding=3)
 
+        self.file_format = Gtk.ComboBoxText()
+        for writer in WRITERS:
+            self.file_format.append_text(writer.name)
+        self.file_format.set_active(0)
+        hbox_csv_export.pack_start(
+            self.file_format, expand=False, fill=True, padding=3)
+
         self.selected_records.connect(
             'changed',
             lambda w: self.ignore_search_limit.set_visible(
@@ -323,94 +400,178 @@ class WinExport(WinCSV):
         self.model2.append((string_, name))
 
     def response(self, dialog, response):
-        if response == Gtk.ResponseType.OK:
-            fields = []
-            iter = self.model2.get_iter_first()
-            while iter:
-                fields.append(self.model2.get_value(iter, 1))
-                iter = self.model2.iter_next(iter)
-            header = self.add_field_names.get_active()
-
-            if self.selected_records.get_active():
-                ids = [r.id for r in self.screen.selected_records]
-                paths = self.screen.selected_paths
-                try:
-                    data = RPCExecute(
-                        'model', self.model, 'export_data',
-                        ids, fields, header,
-                        context=self.context)
-                except RPCException:
-                    data = []
-            elif self.screen_is_tree:
-                ids = [r.id for r in self.screen.listed_records]
-                paths = self.screen.listed_paths
-                try:
-                    data = RPCExecute(
-                        'model', self.model, 'export_data',
-                        ids, fields, header,
-                        context=self.context)
-                except RPCException:
-                    data = []
+        if self.export_writer:
+            if response != Gtk.ResponseType.OK:
+                self.export_stop()
+                self.destroy()
+            return
+        if response != Gtk.ResponseType.OK:
+            self.destroy()
+            return
+        fields = []
+        iter = self.model2.get_iter_first()
+        while iter:
+            fields.append(self.model2.get_value(iter, 1))
+            iter = self.model2.iter_next(iter)
+        header = self.add_field_names.get_active()
+        writer = WRITERS[self.file_format.get_active()]
+
+        if self.saveas.get_active():
+            fname = common.file_selection(_('Save As...'),
+                    action=Gtk.FileChooserAction.SAVE)
+            if not fname:
+                self.destroy()
+                return
+            popup = True
+        else:
+            fileno, fname = tempfile.mkstemp(
+                '.' + writer.extension,
+                common.slugify(self.name) + '_')
+            os.close(fileno)
+            popup = False
+        if not self.export_start(writer, fname, fields, header, popup):
+            self.destroy()
+            return
+
+        if self.selected_records.get_active():
+            ids = [r.id for r in self.screen.selected_records]
+            paths = self.screen.selected_paths
+            self.export_chunks(ids, paths)
+        elif self.screen_is_tree:
+            ids = [r.id for r in self.screen.listed_records]
+            paths = self.screen.listed_paths
+            self.export_chunks(ids, paths)
+        else:
+            domain = self.screen.search_domain(
+                self.screen.screen_container.get_text())
+            if self.ignore_search_limit.get_active():
+                offset, limit = 0, None
             else:
-                paths = None
-                domain = self.screen.search_domain(
-                    self.screen.screen_container.get_text())
-                if self.ignore_search_limit.get_active():
-                    offset, limit = 0, None
-                else:
-                    offset, limit = self.screen.offset, self.screen.limit
+                offset, limit = self.screen.offset, self.screen.limit
+
+            def callback(result):
                 try:
-                    data = RPCExecute(
-                        'model', self.model, 'export_data_domain',
-                        domain, fields, offset, limit, self.screen.order,
-                        header, context=self.context)
+                    ids = result()
                 except RPCException:
-                    data = []
-
-            if self.saveas.get_active():
-                fname = common.file_selection(_('Save As...'),
-                        action=Gtk.FileChooserAction.SAVE)
-                if fname:
-                    self.export_csv(fname, data, paths)
-            else:
-                fileno, fname = tempfile.mkstemp(
-                    '.csv', common.slugify(self.name) + '_')
-                if self.export_csv(fname, data, paths, popup=False):
-                    os.close(fileno)
-                    common.file_open(fname, 'csv')
+                    self.export_stop()
+                    self.destroy()
                 else:
-                    os.close(fileno)
-        self.destroy()
-
-    def export_csv(self, fname, data, paths, popup=True):
-        encoding = self.csv_enc.get_active_text() or 'utf_8_sig'
-        locale_format = self.csv_locale.get_active()
+                    self.export_chunks(ids, None)
+            self.export_progress = RPCExecute(
+                'model', self.model, 'search', domain, offset, limit,
+                self.screen.order, context=self.context, callback=callback)
 
+    def export_start(self, writer, fname, fields, header, popup=True):
+        "Open the writer of the export"
         try:
-            writer = csv.writer(
-                open(fname, 'w', encoding=encoding, newline=''),
-                quotechar=self.get_quotechar(),
-                delimiter=self.get_delimiter())
-            for row, path in zip_longest(data, paths or []):
-                indent = len(path) - 1 if path else 0
-                if row:
-                    writer.writerow(self.format_row(
-                            row, indent=indent, locale_format=locale_format))
-            if popup:
-                if len(data) == 1:
-                    common.message(_('%d record saved.') % len(data))
-                else:
-                    common.message(_('%d records saved.') % len(data))
-            return True
-        except (IOError, UnicodeEncodeError, csv.Error) as exception:
+            self.export_writer = writer(fname, self)
+        except IOError as exception:
             common.warning(str(exception), _('Export failed'))
             return False
+        self.export_fname = fname
+        self.export_fields = fields
+        self.export_header = header
+        self.export_popup = popup
+        self.export_count = 0
+        self.dialog.set_response_sensitive(Gtk.ResponseType.OK, False)
+        self.progressbar.set_fraction(0)
+        self.progressbar.set_text('')
+        self.progressbar.show()
+        return True
+
+    def export_chunks(self, ids, paths):
+        "Export the ids by chunks writing the rows as they are received"
+        chunk = int(CONFIG['client.export_chunk'])
+        paths = iter(paths or [])
+        # Always export at least one chunk to write the header
+        starts = iter(range(0, max(len(ids), 1), chunk))
+
+        def export(start):
+            self.export_progress = RPCExecute(
+                'model', self.model, 'export_data',
+                ids[start:start + chunk], self.export_fields,
+                self.export_header and not start,
+                context=self.context, callback=functools.partial(
+                    callback, start))
+
+        def callback(start, result):
+            try:
+                data = result()
+            except RPCException:
+                self.export_stop()
+                self.destroy()
+                return
+            try:
+                for i, row in enumerate(data):
+                    if self.export_header and not start and not i:
+                        path = None
+                    else:
+                        path = next(paths, None)
+                    indent = len(path) - 1 if path else 0
+                    self.export_writer.writerow(row, indent=indent)
+            except Exception as exception:
+                # The writers may raise their own errors
+                self.export_stop()
+                self.destroy()
+                common.warning(str(exception), _('Export failed'))
+                return
+            self.export_count += len(data)
+            done = min(start + chunk, len(ids))
+            if ids:
+                self.progressbar.set_fraction(done / len(ids))
+            self.progressbar.set_text('%d/%d' % (done, len(ids)))
+            start = next(starts, None)
+            if start is not None:
+                export(start)
+            else:
+                self.export_end()
+        export(next(starts))
+
+    def export_end(self):
+        "Close the export and open or report the file"
+        fname, count = self.export_fname, self.export_count
+        extension = self.export_writer.extension
+        try:
+            self.export_writer.close()
+        except Exception as exception:
+            self.export_writer = None
+            self.export_stop()
+            self.destroy()
+            common.warning(str(exception), _('Export failed'))
+            return
+        self.export_progress = self.export_writer = None
+        self.destroy()
+        if self.export_popup:
+            if count == 1:
+                common.message(_('%d record saved.') % count)
+            else:
+                common.message(_('%d records saved.') % count)
+        else:
+            common.file_open(fname, extension)
+
+    def export_stop(self):
+        "Cancel the running export and remove the partial file"
+        if self.export_progress:
+            self.export_progress.cancel()
+            self.export_progress = None
+        if self.export_writer:
+            try:
+                self.export_writer.close()
+            except Exception:
+                pass
+            self.export_writer = None
+        try:
+            os.remove(self.export_fname)
+        except OSError:
+            pass
 
     @classmethod
     def format_row(cls, line, indent=0, locale_format=True):
         row = []
         for i, val in enumerate(line):
-            if locale_format:
+            if val is None or isinstance(val, str):
+                pass
+            elif locale_format:
                 if isinstance(val, Number):
                     val = locale.str(val)
                 elif isinstance(val, datetime.datetime):
@@ -1,7 +1,9 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 import base64
+import bisect
 import csv
+import functools
 import gettext
 import locale
 from decimal import Decimal
@@ -11,6 +13,7 @@ from gi.repository import Gtk
 import tryton.common as common
 from tryton.common import RPCException, RPCExecute
 from tryton.common.datetime_ import date_parse
+from tryton.config import CONFIG
 from tryton.gui.window.win_csv import WinCSV
 
 _ = gettext.gettext
@@ -26,8 +29,15 @@ class WinImport(WinCSV):
         self.fields_data = {}
         self.fields = {}
         self.fields_invert = {}
+        self.import_batches = None
+        self.import_checkpoint = None
+        self.import_done = []
         super(WinImport, self).__init__()
         self.dialog.set_title(_('CSV Import: %s') % name)
+        self.progressbar = Gtk.ProgressBar(show_text=True)
+        self.progressbar.set_no_show_all(True)
+        self.dialog.vbox.pack_start(
+            self.progressbar, expand=False, fill=True, padding=3)
 
     def add_buttons(self, box):
         button_autodetect = Gtk.Button(
@@ -175,6 +185,13 @@ class WinImport(WinCSV):
         self.model2.clear()
 
     def response(self, dialog, response):
+        if self.import_batches is not None:
+            if response != Gtk.ResponseType.OK:
+                # The running batches are committed, so wait for them
+                self.import_stopped = True
+                self.dialog.set_response_sensitive(
+                    Gtk.ResponseType.CANCEL, False)
+            return
         if response == Gtk.ResponseType.OK:
             fields = []
             iter = self.model2.get_iter_first()
@@ -185,6 +202,7 @@ class WinImport(WinCSV):
             fname = self.import_csv_file.get_filename()
             if fname:
                 self.import_csv(fname, fields)
+                return
         self.destroy()
 
     def import_csv(self, fname, fields):
@@ -193,40 +211,128 @@ class WinImport(WinCSV):
         encoding = self.get_encoding()
         locale_format = self.csv_locale.get_active()
         try:
-            reader = csv.reader(
-                open(fname, 'r', encoding=encoding),
-                quotechar=self.get_quotechar(),
-                delimiter=self.get_delimiter())
-            data = []
-            for i, line in enumerate(reader):
-                if i < skip or not line:
-                    continue
-                row = []
-                for field, val in zip(fields, line):
-                    if locale_format and val:
-                        type_ = self.fields_data[field]['type']
-                        if type_ in ['integer', 'biginteger']:
-                            val = locale.atoi(val)
-                        elif type_ == 'float':
-                            val = locale.atof(val)
-                        elif type_ == 'numeric':
-                            val = Decimal(locale.delocalize(val))
-                        elif type_ in ['date', 'datetime']:
-                            val = date_parse(val, common.date_format())
-                        elif type_ == 'binary':
-                            val = base64.b64decode(val)
-                    row.append(val)
-                data.append(row)
-        except (IOError, UnicodeDecodeError, csv.Error) as exception:
+            file_ = open(fname, 'r', encoding=encoding)
+        except IOError as exception:
             common.warning(str(exception), _("Import failed"))
+            self.destroy()
             return
+        reader = csv.reader(
+            file_,
+            quotechar=self.get_quotechar(),
+            delimiter=self.get_delimiter())
+        # Resume from the checkpoint if the same import failed
+        checkpoint = (fname, tuple(fields), skip)
+        if self.import_checkpoint != checkpoint:
+            self.import_checkpoint = checkpoint
+            self.import_done = []
+        self.import_file = file_
+        self.import_fields = fields
+        self.import_batches = self.import_read(
+            reader, fields, skip, locale_format)
+        self.import_running = {}
+        self.import_count = 0
+        self.import_failed = False
+        self.import_stopped = False
+        self.dialog.set_response_sensitive(Gtk.ResponseType.OK, False)
+        self.progressbar.set_text('')
+        self.progressbar.show()
+        for i in range(max(int(CONFIG['client.import_parallel']), 1)):
+            if not self.import_next():
+                break
+        if not self.import_running:
+            self.import_end()
+
+    def import_read(self, reader, fields, skip, locale_format):
+        "Yield the batches of rows to import as (start, end, data)"
+        chunk = int(CONFIG['client.import_chunk'])
+        # Lines without top level value continue the One2Many of the record
+        nested = any('/' in f for f in fields)
+        tops = [i for i, f in enumerate(fields) if '/' not in f]
+        done = sorted(self.import_done)
+        done_starts = [s for s, e in done]
+        start, data = skip, []
+        for i, line in enumerate(reader):
+            if i < skip:
+                continue
+            k = bisect.bisect_right(done_starts, i) - 1
+            committed = k >= 0 and i < done[k][1]
+            new = not nested or any(line[j] for j in tops if j < len(line))
+            if data and (committed or (new and len(data) >= chunk)):
+                yield start, i, data
+                start, data = i, []
+            if committed:
+                start = i + 1
+                continue
+            if not line:
+                continue
+            row = []
+            for field, val in zip(fields, line):
+                if locale_format and val:
+                    type_ = self.fields_data[field]['type']
+                    if type_ in ['integer', 'biginteger']:
+                        val = locale.atoi(val)
+                    elif type_ == 'float':
+                        val = locale.atof(val)
+                    elif type_ == 'numeric':
+                        val = Decimal(locale.delocalize(val))
+                    elif type_ in ['date', 'datetime']:
+                        val = date_parse(val, common.date_format())
+                    elif type_ == 'binary':
+                        val = base64.b64decode(val)
+                row.append(val)
+            data.append(row)
+        if data:
+            yield start, i + 1, data
+
+    def import_next(self):
+        "Send the next batch and return if there was one"
+        if self.import_stopped or self.import_failed:
+            return False
         try:
-            count = RPCExecute(
-                'model', self.model, 'import_data', fields, data,
-                context=self.context)
+            batch = next(self.import_batches, None)
+        except (IOError, ValueError, csv.Error) as exception:
+            common.warning(str(exception), _("Import failed"))
+            self.import_failed = True
+            return False
+        if batch is None:
+            return False
+        start, end, data = batch
+        self.import_running[start] = RPCExecute(
+            'model', self.model, 'import_data', self.import_fields, data,
+            context=self.context,
+            callback=functools.partial(self.import_callback, start, end))
+        return True
+
+    def import_callback(self, start, end, result):
+        del self.import_running[start]
+        try:
+            count = result()
         except RPCException:
-            return
+            self.import_failed = True
+        else:
+            self.import_count += count
+            self.import_done.append((start, end))
+            self.progressbar.pulse()
+            self.progressbar.set_text(
+                _('%d records imported.') % self.import_count)
+        if not self.import_next() and not self.import_running:
+            self.import_end()
+
+    def import_end(self):
+        self.import_file.close()
+        self.import_batches = None
+        count = self.import_count
         if count == 1:
-            common.message(_('%d record imported.') % count)
+            msg = _('%d record imported.') % count
+        else:
+            msg = _('%d records imported.') % count
+        if self.import_failed and not self.import_stopped:
+            # Keep the dialog to resume from the last committed batch
+            self.dialog.set_response_sensitive(Gtk.ResponseType.OK, True)
+            self.progressbar.set_text(msg)
+            common.warning(
+                _('The import can be resumed by validating again.'),
+                _("Import failed"))
         else:
-            common.message(_('%d records imported.') % count)
+            self.destroy()
+            common.message(msg)
@@ -7,33 +7,30 @@ import hashlib
 import http.client
 import json
 import logging
+import select
 import socket
+import sqlite3
 import ssl
 import threading
+import time
 import xmlrpc.client
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from contextlib import contextmanager
 from decimal import Decimal
 from functools import partial, reduce
+from http import HTTPStatus
 from urllib.parse import quote, urljoin
 
 __all__ = ["ResponseError", "Fault", "ProtocolError", "Transport",
     "ServerProxy", "ServerPool"]
 CONNECT_TIMEOUT = 5
+# The HTTP status which must be handled by the caller of a batch
+_BATCH_RAISE = {str(int(s)) for s in [
+        HTTPStatus.UNAUTHORIZED, HTTPStatus.FORBIDDEN]}
 DEFAULT_TIMEOUT = None
 logger = logging.getLogger(__name__)
 
 
-def deepcopy(obj):
-    """Recursively copy python mutable datastructures"""
-    if isinstance(obj, (list, tuple)):
-        return [deepcopy(o) for o in obj]
-    elif isinstance(obj, dict):
-        return {k: deepcopy(v) for k, v in obj.items()}
-    else:
-        return obj
-
-
 class ResponseError(xmlrpc.client.ResponseError):
     pass
 
@@ -52,22 +49,24 @@ class ProtocolError(xmlrpc.client.ProtocolError):
     pass
 
 
+_CLASS_DECODERS = {
+    'datetime': lambda dct: datetime.datetime(
+        dct['year'], dct['month'], dct['day'],
+        dct['hour'], dct['minute'], dct['second'], dct['microsecond']),
+    'date': lambda dct: datetime.date(dct['year'], dct['month'], dct['day']),
+    'time': lambda dct: datetime.time(
+        dct['hour'], dct['minute'], dct['second'], dct['microsecond']),
+    'timedelta': lambda dct: datetime.timedelta(seconds=dct['seconds']),
+    'bytes': lambda dct: base64.decodebytes(dct['base64'].encode('utf-8')),
+    'Decimal': lambda dct: Decimal(dct['decimal']),
+    }
+
+
 def object_hook(dct):
     if '__class__' in dct:
-        if dct['__class__'] == 'datetime':
-            return datetime.datetime(dct['year'], dct['month'], dct['day'],
-                dct['hour'], dct['minute'], dct['second'], dct['microsecond'])
-        elif dct['__class__'] == 'date':
-            return datetime.date(dct['year'], dct['month'], dct['day'])
-        elif dct['__class__'] == 'time':
-            return datetime.time(dct['hour'], dct['minute'], dct['second'],
-                dct['microsecond'])
-        elif dct['__class__'] == 'timedelta':
-            return datetime.timedelta(seconds=dct['seconds'])
-        elif dct['__class__'] == 'bytes':
-            return base64.decodebytes(dct['base64'].encode('utf-8'))
-        elif dct['__class__'] == 'Decimal':
-            return Decimal(dct['decimal'])
+        decoder = _CLASS_DECODERS.get(dct['__class__'])
+        if decoder:
+            return decoder(dct)
     return dct
 
 
@@ -126,19 +125,26 @@ class JSONParser(object):
 
 class JSONUnmarshaller(object):
     def __init__(self):
-        self.data = []
+        self.data = bytearray()
 
     def feed(self, data):
-        self.data.append(data.decode('utf-8'))
+        self.data += data
 
     def close(self):
-        return json.loads(''.join(self.data), object_hook=object_hook)
+        data, self.data = self.data, None
+        # The hook is called for every object so skip it when there are no
+        # typed values to decode
+        hook = object_hook if b'"__class__"' in data else None
+        text = data.decode('utf-8')
+        del data
+        return json.loads(text, object_hook=hook)
 
 
 class Transport(xmlrpc.client.SafeTransport):
 
     accept_gzip_encoding = True
     encode_threshold = 1400  # common MTU
+    read_size = 256 * 1024
 
     def __init__(
             self, fingerprints=None, ca_certs=None, session=None):
@@ -155,16 +161,46 @@ class Transport(xmlrpc.client.SafeTransport):
 
     def parse_response(self, response):
         cache = None
+        stream = response
         if hasattr(response, 'getheader'):
             cache = int(response.getheader('X-Tryton-Cache', 0))
-        response = super().parse_response(response)
-        if cache:
+            if response.getheader('Content-Encoding', '') == 'gzip':
+                stream = xmlrpc.client.GzipDecodedResponse(response)
+
+        parser, unmarshaller = self.getparser()
+        # Read by large chunks as the standard implementation reads only
+        # 1024 bytes at a time
+        while True:
+            data = stream.read(self.read_size)
+            if not data:
+                break
+            if self.verbose:
+                print("body:", repr(data))
+            parser.feed(data)
+        if stream is not response:
+            stream.close()
+        parser.close()
+        response = unmarshaller.close()
+        if cache and isinstance(response, dict):
             try:
                 response['cache'] = int(cache)
             except ValueError:
                 pass
         return response
 
+    @property
+    def alive(self):
+        "Test if the server did not close the connection"
+        _, connection = self._connection
+        if not connection or not connection.sock:
+            return True
+        try:
+            # An idle connection is readable only when the server closed it
+            readable, _, _ = select.select([connection.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
     def get_host_info(self, host):
         host, extra_headers, x509 = xmlrpc.client.Transport.get_host_info(
             self, host)
@@ -244,6 +280,7 @@ class Transport(xmlrpc.client.SafeTransport):
 
 class ServerProxy(xmlrpc.client.ServerProxy):
     __id = 0
+    batch_supported = True
 
     def __init__(self, host, port, database='', verbose=0,
             fingerprints=None, ca_certs=None, session=None, cache=None):
@@ -271,10 +308,27 @@ class ServerProxy(xmlrpc.client.ServerProxy):
                 'method': methodname,
                 'params': params,
                 }).encode('utf-8')
+        response = self.__send(request)
+        if response['id'] != id_:
+            raise ResponseError('Invalid response id (%s) excpected %s' %
+                (response['id'], id_))
+        if response.get('error'):
+            raise Fault(*response['error'])
+        self.__set_cache(methodname, params, response)
+        return response['result']
 
+    def __set_cache(self, methodname, params, response):
+        if self.__cache and response.get('cache'):
+            dumper = partial(
+                json.dumps, cls=JSONEncoder, separators=(',', ':'))
+            self.__cache.set(
+                methodname, dumper(params), response['cache'],
+                response['result'])
+
+    def __send(self, request):
         try:
             try:
-                response = self.__transport.request(
+                return self.__transport.request(
                     self.__host,
                     self.__handler,
                     request,
@@ -286,7 +340,7 @@ class ServerProxy(xmlrpc.client.ServerProxy):
                     raise
                 # try one more time
                 self.__transport.close()
-                response = self.__transport.request(
+                return self.__transport.request(
                     self.__host,
                     self.__handler,
                     request,
@@ -297,20 +351,79 @@ class ServerProxy(xmlrpc.client.ServerProxy):
         except Exception:
             self.__transport.close()
             raise
-        if response['id'] != id_:
-            raise ResponseError('Invalid response id (%s) excpected %s' %
-                (response['id'], id_))
-        if response.get('error'):
-            raise Fault(*response['error'])
-        if self.__cache and response.get('cache'):
-            self.__cache.set(
-                methodname, dumper(params), response['cache'],
-                response['result'])
-        return response['result']
+
+    def batch(self, calls):
+        """Send the calls as a single JSON-RPC batch request
+        and return the list of results or Fault instances.
+        The calls are sent sequentially if the server rejects the batch."""
+        dumper = partial(json.dumps, cls=JSONEncoder, separators=(',', ':'))
+        results = [None] * len(calls)
+        requests, indexes = [], {}
+        for i, (methodname, params) in enumerate(calls):
+            if self.__cache and self.__cache.cached(methodname):
+                try:
+                    results[i] = self.__cache.get(methodname, dumper(params))
+                    continue
+                except KeyError:
+                    pass
+            self.__id += 1
+            indexes[self.__id] = i
+            requests.append({
+                    'id': self.__id,
+                    'method': methodname,
+                    'params': params,
+                    })
+
+        responses = None
+        if self.batch_supported and len(requests) > 1:
+            try:
+                responses = self.__send(dumper(requests).encode('utf-8'))
+            except Fault as exception:
+                if exception.faultCode in _BATCH_RAISE:
+                    raise
+            if not self.__valid_batch(responses, indexes):
+                # Servers without batch support answer with an error (even
+                # 500) so it is disabled for the session
+                logger.info('batch request not supported')
+                self.batch_supported = False
+                responses = None
+        if responses is None:
+            for request in requests:
+                try:
+                    result = self.__request(
+                        request['method'], request['params'])
+                except Fault as exception:
+                    result = exception
+                results[indexes[request['id']]] = result
+            return results
+
+        for response in responses:
+            i = indexes[response['id']]
+            if response.get('error'):
+                results[i] = Fault(*response['error'])
+            else:
+                methodname, params = calls[i]
+                self.__set_cache(methodname, params, response)
+                results[i] = response['result']
+        return results
+
+    @staticmethod
+    def __valid_batch(responses, indexes):
+        if not isinstance(responses, list):
+            return False
+        try:
+            ids = [r['id'] for r in responses]
+        except (TypeError, KeyError):
+            return False
+        return sorted(ids) == sorted(indexes)
 
     def close(self):
         self.__transport.close()
 
+    @property
+    def alive(self):
+        return self.__transport.alive
+
     @property
     def ssl(self):
         return isinstance(self.__transport.make_connection(self.__host),
@@ -324,11 +437,36 @@ class ServerProxy(xmlrpc.client.ServerProxy):
 
 class ServerPool(object):
     keep_max = 4
+    # The maximum seconds to wait for a connection when the pool is full
+    wait_timeout = 5 * 60
     _cache = None
 
     def __init__(self, host, port, database, *args, **kwargs):
+        self.min_size = self._size(kwargs.pop('pool_min', None), 'pool_min')
+        self.max_size = self._size(kwargs.pop('pool_max', None), 'pool_max')
+        if self.max_size and self.min_size > self.max_size:
+            # Otherwise warm would wait for connections which can not be
+            # opened
+            logger.warning('pool_min (%s) larger than pool_max (%s)',
+                self.min_size, self.max_size)
+            self.min_size = self.max_size
+        self.idle_timeout = kwargs.pop('idle_timeout', None)
+        cache_path = kwargs.pop('cache_path', None)
+        cache_size = kwargs.pop('cache_size', None)
+        cache_memory = kwargs.pop('cache_memory', None)
+        cache_prefix_memory = kwargs.pop('cache_prefix_memory', None)
         if kwargs.get('cache'):
-            self._cache = kwargs['cache'] = _Cache()
+            if cache_path:
+                # The session is "login:user_id:key", the key changes at
+                # each login
+                user = (kwargs.get('session') or '').rsplit(':', 1)[0]
+                namespace = '%s@%s:%s/%s' % (user, host, port, database)
+                self._cache = kwargs['cache'] = _PersistentCache(
+                    cache_path, namespace, size=cache_size,
+                    memory=cache_memory, prefix_memory=cache_prefix_memory)
+            else:
+                self._cache = kwargs['cache'] = _Cache(
+                    memory=cache_memory, prefix_memory=cache_prefix_memory)
         self.ServerProxy = partial(
             ServerProxy, host, port, database, *args, **kwargs)
 
@@ -336,53 +474,147 @@ class ServerPool(object):
         self._port = port
         self._database = database
 
-        self._lock = threading.Lock()
+        self._lock = threading.Condition()
+        # The idle connections with the time they were put back,
+        # from the oldest to the most recent
         self._pool = []
-        self._used = {}
+        self._used = set()
+        self._closed = False
         self.session = kwargs.get('session')
+        self.batch_supported = True
+        self.checkouts = self.waits = self.reconnects = 0
+
+    @staticmethod
+    def _size(value, name):
+        # The sizes may come as strings from the configuration file
+        try:
+            size = int(value or 0)
+        except ValueError:
+            size = -1
+        if size < 0:
+            logger.warning('invalid %s: %r', name, value)
+            size = 0
+        return size
 
     def getconn(self):
+        deadline = time.monotonic() + self.wait_timeout
         with self._lock:
-            if self._pool:
-                conn = self._pool.pop()
-            else:
-                conn = self.ServerProxy()
-            self._used[id(conn)] = conn
-            return conn
+            self._close_idle()
+            while True:
+                if self._closed:
+                    raise http.client.CannotSendRequest(
+                        'connection pool closed')
+                if self._pool:
+                    conn, _ = self._pool.pop()
+                    break
+                elif not self.max_size or len(self._used) < self.max_size:
+                    conn = self.ServerProxy()
+                    break
+                self.waits += 1
+                logger.debug('wait for a connection: %s', self.statistics)
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 or not self._lock.wait(timeout):
+                    raise socket.timeout(
+                        'timed out waiting for a connection')
+            self._used.add(conn)
+            self.checkouts += 1
+        if not conn.alive:
+            # The server closed the connection so a new one will be opened
+            conn.close()
+            with self._lock:
+                self.reconnects += 1
+        return conn
 
     def putconn(self, conn):
         with self._lock:
-            self._pool.append(conn)
-            del self._used[id(conn)]
+            self._used.discard(conn)
+            if self._closed:
+                conn.close()
+                return
+            self._pool.append((conn, time.monotonic()))
 
             # Remove oldest connections
-            while len(self._pool) > self.keep_max:
-                conn = self._pool.pop()
+            while len(self._pool) > max(self.keep_max, self.min_size):
+                conn, _ = self._pool.pop(0)
                 conn.close()
+            self._lock.notify()
+
+    def _close_idle(self):
+        if not self.idle_timeout:
+            return
+        now = time.monotonic()
+        while (len(self._pool) > self.min_size
+                and now - self._pool[0][1] > self.idle_timeout):
+            conn, _ = self._pool.pop(0)
+            conn.close()
+
+    def warm(self, size=None):
+        "Open in advance size connections"
+        conns = [self.getconn() for _ in range(size or self.min_size)]
+        try:
+            for conn in conns:
+                try:
+                    conn.ssl  # Connect and negotiate TLS
+                except Exception:
+                    logger.info('Unable to warm connection', exc_info=True)
+                    break
+        finally:
+            for conn in conns:
+                self.putconn(conn)
 
     def close(self):
         with self._lock:
-            for conn in self._pool + list(self._used.values()):
+            logger.info('connection pool statistics: %s', self.statistics)
+            for conn in self._conns:
                 conn.close()
             self._pool = []
             self._used.clear()
+            self._closed = True
+            self._lock.notify_all()
+        if self._cache:
+            self._cache.close()
+
+    @property
+    def _conns(self):
+        return [c for c, _ in self._pool] + list(self._used)
+
+    @property
+    def statistics(self):
+        return {
+            'idle': len(self._pool),
+            'used': len(self._used),
+            'checkouts': self.checkouts,
+            'waits': self.waits,
+            'reconnects': self.reconnects,
+            }
 
     @property
     def ssl(self):
-        for conn in self._pool + list(self._used.values()):
+        for conn in self._conns:
             return conn.ssl
         return None
 
     @property
     def url(self):
-        for conn in self._pool + list(self._used.values()):
+        for conn in self._conns:
             return conn.url
 
     @contextmanager
     def __call__(self):
         conn = self.getconn()
-        yield conn
-        self.putconn(conn)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def batch(self, calls):
+        "Execute the list of (methodname, params) in a single request"
+        with self() as conn:
+            conn.batch_supported = self.batch_supported
+            try:
+                return conn.batch(calls)
+            finally:
+                self.batch_supported = conn.batch_supported
 
     def clear_cache(self, prefix=None):
         if self._cache:
@@ -390,34 +622,231 @@ class ServerPool(object):
 
 
 class _Cache:
-
-    def __init__(self):
-        self.store = defaultdict(dict)
+    "Cache storing the results as JSON to return a fresh copy at each hit"
+    default_memory = 64 * 1024 * 1024
+    sweep_interval = 60
+
+    def __init__(self, memory=None, prefix_memory=None):
+        self.memory = int(memory or self.default_memory)
+        self.prefix_memory = int(prefix_memory or self.memory // 4)
+        # Each prefix keeps its entries from the least to the most recently
+        # used and lru does the same for all the (prefix, key)
+        self.store = defaultdict(OrderedDict)
+        self.lru = OrderedDict()
+        self.sizes = defaultdict(int)
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.RLock()
+        self._last_sweep = time.monotonic()
+
+    @staticmethod
+    def _dumps(value):
+        return json.dumps(
+            value, cls=JSONEncoder, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def _loads(data):
+        return json.loads(data, object_hook=object_hook)
+
+    @staticmethod
+    def _expire(expire):
+        if isinstance(expire, (int, float)):
+            expire = datetime.timedelta(seconds=expire)
+        if isinstance(expire, datetime.timedelta):
+            expire = datetime.datetime.now() + expire
+        return expire
 
     def cached(self, prefix):
         return prefix in self.store
 
     def set(self, prefix, key, expire, value):
-        if isinstance(expire, (int, float)):
-            expire = datetime.timedelta(seconds=expire)
-        if isinstance(expire, datetime.timedelta):
-            expire = datetime.datetime.now() + expire
-        self.store[prefix][key] = (expire, deepcopy(value))
+        self._put(prefix, key, self._expire(expire), self._dumps(value))
+
+    def _put(self, prefix, key, expire, data):
+        size = len(key) + len(data)
+        with self._lock:
+            self._pop(prefix, key)
+            if size > self.prefix_memory:
+                self.store[prefix]
+                return
+            self.store[prefix][key] = (expire, data, size)
+            self.lru[prefix, key] = None
+            self.sizes[prefix] += size
+            self.size += size
+            while self.sizes[prefix] > self.prefix_memory:
+                self._evict(prefix, next(iter(self.store[prefix])))
+            while self.size > self.memory:
+                self._evict(*next(iter(self.lru)))
+        self._sweep()
+
+    def _pop(self, prefix, key):
+        try:
+            _, _, size = self.store[prefix].pop(key)
+        except KeyError:
+            return
+        del self.lru[prefix, key]
+        self.sizes[prefix] -= size
+        self.size -= size
+
+    def _evict(self, prefix, key):
+        self._pop(prefix, key)
+        self.evictions += 1
 
     def get(self, prefix, key):
         now = datetime.datetime.now()
+        with self._lock:
+            try:
+                expire, data, _ = self.store[prefix][key]
+            except KeyError:
+                self.misses += 1
+                raise
+            if expire < now:
+                self._pop(prefix, key)
+                self.misses += 1
+                raise KeyError
+            self.store[prefix].move_to_end(key)
+            self.lru.move_to_end((prefix, key))
+            self.hits += 1
+        logger.info('(cached) %s %s', prefix, key)
+        return self._loads(data)
+
+    def _sweep(self):
+        if time.monotonic() - self._last_sweep < self.sweep_interval:
+            return
+        now = datetime.datetime.now()
+        with self._lock:
+            self._last_sweep = time.monotonic()
+            for prefix, entries in self.store.items():
+                for key, (expire, _, _) in list(entries.items()):
+                    if expire < now:
+                        self._evict(prefix, key)
+        logger.debug('cache statistics: %s', self.statistics)
+
+    @property
+    def statistics(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.lru),
+                'size': self.size,
+                }
+
+    def clear(self, prefix=None):
+        with self._lock:
+            if prefix:
+                for key in list(self.store[prefix]):
+                    self._pop(prefix, key)
+            else:
+                self.store.clear()
+                self.lru.clear()
+                self.sizes.clear()
+                self.size = 0
+
+    def close(self):
+        pass
+
+
+class _PersistentCache(_Cache):
+    "Cache which keeps the results on disk between sessions"
+    default_size = 5000
+
+    def __init__(self, path, namespace, size=None, **kwargs):
+        super().__init__(**kwargs)
+        self.namespace = namespace
+        self.entries = int(size or self.default_size)
+        self._database_lock = threading.Lock()
         try:
-            expire, value = self.store[prefix][key]
-        except ValueError:
-            raise KeyError
-        if expire < now:
-            self.store.pop(key)
+            self._database = sqlite3.connect(
+                path, timeout=CONNECT_TIMEOUT, check_same_thread=False,
+                isolation_level=None)
+            with self._database_lock:
+                self._database.execute(
+                    'CREATE TABLE IF NOT EXISTS cache ('
+                    'namespace TEXT NOT NULL, '
+                    'prefix TEXT NOT NULL, '
+                    'key TEXT NOT NULL, '
+                    'expire REAL NOT NULL, '
+                    'accessed REAL NOT NULL, '
+                    'value BLOB NOT NULL, '
+                    'PRIMARY KEY (namespace, prefix, key))')
+                self._database.execute(
+                    'DELETE FROM cache WHERE expire < ?', (time.time(),))
+                cursor = self._database.execute(
+                    'SELECT DISTINCT prefix FROM cache WHERE namespace = ?',
+                    (self.namespace,))
+                for prefix, in cursor:
+                    self.store[prefix]
+        except sqlite3.Error:
+            logger.error(
+                "Unable to open cache file %s", path, exc_info=True)
+            self._database = None
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _execute(self, query, parameters=()):
+        if not self._database:
+            return []
+        try:
+            with self._database_lock:
+                return self._database.execute(query, parameters).fetchall()
+        except sqlite3.Error:
+            logger.warning("Unable to access cache file", exc_info=True)
+            return []
+
+    def set(self, prefix, key, expire, value):
+        expire = self._expire(expire)
+        data = self._dumps(value)
+        self._put(prefix, key, expire, data)
+        now = time.time()
+        self._execute(
+            'INSERT OR REPLACE INTO cache '
+            '(namespace, prefix, key, expire, accessed, value) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (self.namespace, prefix, self._hash(key), expire.timestamp(),
+                now, data))
+        self._execute(
+            'DELETE FROM cache WHERE rowid IN ('
+            'SELECT rowid FROM cache ORDER BY accessed DESC '
+            'LIMIT -1 OFFSET ?)', (self.entries,))
+
+    def get(self, prefix, key):
+        try:
+            return super().get(prefix, key)
+        except KeyError:
+            pass
+        now = time.time()
+        rows = self._execute(
+            'SELECT expire, value FROM cache '
+            'WHERE namespace = ? AND prefix = ? AND key = ? AND expire >= ?',
+            (self.namespace, prefix, self._hash(key), now))
+        if not rows:
             raise KeyError
-        logger.info('(cached) %s %s', prefix, key)
-        return deepcopy(value)
+        (expire, data), = rows
+        self._execute(
+            'UPDATE cache SET accessed = ? '
+            'WHERE namespace = ? AND prefix = ? AND key = ?',
+            (now, self.namespace, prefix, self._hash(key)))
+        self._put(
+            prefix, key, datetime.datetime.fromtimestamp(expire), data)
+        logger.info('(cached on disk) %s %s', prefix, key)
+        return self._loads(data)
 
     def clear(self, prefix=None):
+        super().clear(prefix)
         if prefix:
-            self.store[prefix].clear()
+            self._execute(
+                'DELETE FROM cache WHERE namespace = ? AND prefix = ?',
+                (self.namespace, prefix))
         else:
-            self.store.clear()
+            self._execute(
+                'DELETE FROM cache WHERE namespace = ?', (self.namespace,))
+
+    def close(self):
+        if self._database:
+            with self._database_lock:
+                self._database.close()
+            self._database = None
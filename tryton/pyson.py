@@ -3,7 +3,7 @@
 import datetime
 import json
 from decimal import Decimal
-from functools import reduce
+from functools import lru_cache, reduce
 
 from dateutil.relativedelta import relativedelta
 
@@ -762,3 +762,83 @@ CONTEXT = {
     'true': True,
     'false': False,
 }
+
+
+@lru_cache(maxsize=4096)
+def compile_pyson(expr):
+    """Compile the PYSON string into a function evaluating it with a context
+
+    The names attribute of the function contains the names read from the
+    context or None if they can not be known before the evaluation."""
+    names = set()
+    evaluate = _compile(json.loads(expr), names)
+    evaluate.names = None if None in names else frozenset(names)
+    return evaluate
+
+
+def get_eval_depends(*exprs):
+    """Return the names of the fields and of the parent fields evaluated by
+    the PYSON strings or None if they can not be known"""
+    names, parent_names = set(), set()
+    for expr in exprs:
+        if not expr or not isinstance(expr, str):
+            continue
+        evaluated = compile_pyson(expr).names
+        if evaluated is None or 'context' in evaluated:
+            return None
+        for name in evaluated:
+            if name.startswith('_parent_'):
+                if '.' in name:
+                    parent_names.add(Eval(name.split('.', 1)[1]).basename)
+                elif not any(n.startswith(name + '.') for n in evaluated):
+                    return None
+            else:
+                names.add(Eval(name).basename)
+    return frozenset(names), frozenset(parent_names)
+
+
+def _compile(value, names):
+    if isinstance(value, dict):
+        klass = None
+        if '__class__' in value:
+            klass = CONTEXT.get(value['__class__'])
+        if klass is Eval:
+            if isinstance(value['v'], str):
+                names.add(value['v'])
+                names.add(value['v'].split('.', 1)[0])
+                if _constant(value['d']):
+                    return _compile_eval(value['v'], value['d'])
+            else:
+                names.add(None)
+        items = [(k, _compile(v, names)) for k, v in value.items()]
+        if klass:
+            eval_ = klass.eval
+
+            def evaluate(context):
+                return eval_({k: f(context) for k, f in items}, context)
+        else:
+            def evaluate(context):
+                return {k: f(context) for k, f in items}
+        return evaluate
+    elif isinstance(value, list):
+        items = [_compile(v, names) for v in value]
+        return lambda context: [f(context) for f in items]
+    else:
+        return lambda context: value
+
+
+def _constant(value):
+    return not isinstance(value, (dict, list))
+
+
+def _compile_eval(name, default):
+    if '.' not in name:
+        return lambda context: context.get(name, default)
+    base, sub_name = name.split('.', 1)
+    sub_eval = _compile_eval(sub_name, default)
+
+    def evaluate(context):
+        if name in context:
+            return context.get(name, default)
+        return sub_eval(context.get(base) or {})
+    return evaluate
@@ -4,6 +4,7 @@ import http.client
 import logging
 import os
 import socket
+import threading
 
 try:
     from http import HTTPStatus
@@ -27,6 +28,7 @@ _KEYWORD_CACHE = {}
 _CA_CERTS = os.path.join(get_config_dir(), 'ca_certs')
 if not os.path.isfile(_CA_CERTS):
     _CA_CERTS = None
+_CACHE_PATH = os.path.join(get_config_dir(), 'cache.sqlite')
 
 ServerProxy = partial(ServerProxy, fingerprints=fingerprints,
     ca_certs=_CA_CERTS)
@@ -82,6 +84,21 @@ def authentication_services(host, port):
         return '', []
 
 
+def _pool_options():
+    options = {
+        'pool_min': CONFIG['connection.pool_min'],
+        'pool_max': CONFIG['connection.pool_max'],
+        'idle_timeout': float(CONFIG['connection.idle_timeout']),
+        'cache': not CONFIG['dev'],
+        'cache_memory': CONFIG['cache.memory'],
+        'cache_prefix_memory': CONFIG['cache.prefix_memory'],
+        }
+    if CONFIG['cache.persistent']:
+        options['cache_path'] = _CACHE_PATH
+        options['cache_size'] = CONFIG['cache.persistent_size']
+    return options
+
+
 def set_service_session(parameters):
     from tryton import common
     global CONNECTION, _USER
@@ -104,7 +121,8 @@ def set_service_session(parameters):
     if CONNECTION is not None:
         CONNECTION.close()
     CONNECTION = ServerPool(
-        hostname, port, database, session=session, cache=not CONFIG['dev'])
+        hostname, port, database, session=session, **_pool_options())
+    threading.Thread(target=CONNECTION.warm, daemon=True).start()
     bus.listen(CONNECTION)
 
 
@@ -128,7 +146,8 @@ def login(parameters):
     if CONNECTION is not None:
         CONNECTION.close()
     CONNECTION = ServerPool(
-        hostname, port, database, session=session, cache=not CONFIG['dev'])
+        hostname, port, database, session=session, **_pool_options())
+    threading.Thread(target=CONNECTION.warm, daemon=True).start()
     device_cookie.renew()
     bus.listen(CONNECTION)
 
@@ -163,6 +182,55 @@ def execute(*args):
     return result
 
 
+def execute_multi(*calls):
+    """Execute the calls in a single request
+    and return for each a function which returns the result or raises"""
+    if CONNECTION is None:
+        raise TrytonServerError('403')
+    if not CONNECTION.batch_supported:
+        results = _execute_parallel(calls)
+    else:
+        calls = [('.'.join(args[:3]), args[3:]) for args in calls]
+        try:
+            for name, args in calls:
+                logging.getLogger(__name__).info('%s%s' % (name, args))
+            results = CONNECTION.batch(calls)
+        except (http.client.CannotSendRequest, socket.error) as exception:
+            raise TrytonServerUnavailable(*exception.args)
+        logging.getLogger(__name__).debug(repr(results))
+
+    def return_(result):
+        def func():
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return func
+    return [return_(r) for r in results]
+
+
+def _execute_parallel(calls):
+    "Execute the calls in parallel threads when the server can not batch"
+    results = [None] * len(calls)
+
+    def target(i, args):
+        try:
+            results[i] = execute(*args)
+        except (TrytonServerError, TrytonServerUnavailable) as exception:
+            results[i] = exception
+    threads = []
+    for i, args in enumerate(calls):
+        thread = threading.Thread(target=target, args=(i, args))
+        threads.append(thread)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    unavailable = [
+        r for r in results if isinstance(r, TrytonServerUnavailable)]
+    if unavailable:
+        raise unavailable[0]
+    return results
+
+
 def clear_cache(prefix=None):
     if CONNECTION:
         CONNECTION.clear_cache(prefix)
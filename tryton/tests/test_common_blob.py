@@ -0,0 +1,72 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import os
+from unittest import TestCase
+
+from tryton.common.blob import BlobStore
+
+
+class BlobStoreTestCase(TestCase):
+    "Test common blob"
+
+    def setUp(self):
+        self.store = BlobStore()
+
+    def test_add(self):
+        "Test add"
+        blob = self.store.add(b'foo')
+
+        self.assertEqual(blob.size, 3)
+        self.assertEqual(blob.read(), b'foo')
+        with blob.view() as view:
+            self.assertEqual(view, b'foo')
+
+    def test_add_str(self):
+        "Test add string"
+        blob = self.store.add('é')
+
+        self.assertEqual(blob.read(), 'é'.encode('utf-8'))
+
+    def test_add_empty(self):
+        "Test add empty"
+        blob = self.store.add(None)
+
+        self.assertEqual(blob.size, 0)
+        self.assertEqual(blob.read(), b'')
+
+    def test_shared(self):
+        "Test same content is shared"
+        blob1 = self.store.add(b'foo')
+        blob2 = self.store.add(b'foo')
+        filename = self.store.filename(blob1.digest)
+
+        self.assertEqual(blob1.digest, blob2.digest)
+        self.assertEqual(len(self.store), 1)
+
+        blob1.release()
+        self.assertTrue(os.path.exists(filename))
+        self.assertEqual(blob2.read(), b'foo')
+
+        blob2.release()
+        self.assertFalse(os.path.exists(filename))
+        self.assertEqual(len(self.store), 0)
+
+    def test_release_twice(self):
+        "Test release twice"
+        blob1 = self.store.add(b'foo')
+        blob2 = self.store.add(b'foo')
+
+        blob1.release()
+        blob1.release()
+
+        self.assertEqual(len(self.store), 1)
+        self.assertTrue(blob1.released)
+        self.assertFalse(blob2.released)
+
+    def test_read_released(self):
+        "Test read released"
+        blob = self.store.add(b'foo')
+        blob.release()
+
+        with self.assertRaises(ValueError):
+            blob.read()
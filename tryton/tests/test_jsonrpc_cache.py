@@ -0,0 +1,243 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import datetime as dt
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from tryton.jsonrpc import _Cache, _PersistentCache
+
+
+class CacheTestCase(TestCase):
+    "Test cache"
+
+    def test_get(self):
+        "Test get returns a copy"
+        cache = _Cache()
+        cache.set('model.read', 'key', 60, {'foo': ['bar']})
+
+        value = cache.get('model.read', 'key')
+        value['foo'].append('baz')
+
+        self.assertEqual(cache.get('model.read', 'key'), {'foo': ['bar']})
+        self.assertEqual(cache.statistics['hits'], 2)
+
+    def test_missing(self):
+        "Test get missing"
+        cache = _Cache()
+
+        with self.assertRaises(KeyError):
+            cache.get('model.read', 'key')
+        self.assertEqual(cache.statistics['misses'], 1)
+
+    def test_expire(self):
+        "Test get expired"
+        cache = _Cache()
+        cache.set('model.read', 'key', -1, 'foo')
+
+        with self.assertRaises(KeyError):
+            cache.get('model.read', 'key')
+        self.assertEqual(cache.statistics['entries'], 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_memory(self):
+        "Test the least recently used entries are evicted"
+        # Each entry uses 1 byte of key and 12 bytes of data
+        cache = _Cache(memory=30, prefix_memory=30)
+        cache.set('model.read', 'a', 60, 'a' * 10)
+        cache.set('model.search', 'b', 60, 'b' * 10)
+        cache.get('model.read', 'a')
+        cache.set('model.read', 'c', 60, 'c' * 10)
+
+        self.assertEqual(cache.get('model.read', 'a'), 'a' * 10)
+        self.assertEqual(cache.get('model.read', 'c'), 'c' * 10)
+        with self.assertRaises(KeyError):
+            cache.get('model.search', 'b')
+        self.assertEqual(cache.size, 26)
+        self.assertEqual(cache.statistics['evictions'], 1)
+
+    def test_prefix_memory(self):
+        "Test a prefix evicts only its own entries"
+        cache = _Cache(memory=100, prefix_memory=30)
+        cache.set('model.search', 'b', 60, 'b' * 10)
+        for key in ['a', 'c', 'd']:
+            cache.set('model.read', key, 60, key * 10)
+
+        self.assertEqual(cache.get('model.search', 'b'), 'b' * 10)
+        with self.assertRaises(KeyError):
+            cache.get('model.read', 'a')
+        self.assertEqual(cache.sizes['model.read'], 26)
+
+    def test_too_large(self):
+        "Test an entry larger than the prefix budget is not stored"
+        cache = _Cache(memory=100, prefix_memory=10)
+        cache.set('model.read', 'a', 60, 'a' * 10)
+
+        self.assertTrue(cache.cached('model.read'))
+        with self.assertRaises(KeyError):
+            cache.get('model.read', 'a')
+        self.assertEqual(cache.size, 0)
+
+    def test_replace(self):
+        "Test replace an entry"
+        cache = _Cache()
+        cache.set('model.read', 'a', 60, 'foo')
+        cache.set('model.read', 'a', 60, 'foobar')
+
+        self.assertEqual(cache.get('model.read', 'a'), 'foobar')
+        self.assertEqual(cache.size, 9)
+
+    def test_sweep(self):
+        "Test sweep removes the expired entries"
+        cache = _Cache()
+        cache.set('model.read', 'a', -1, 'foo')
+        cache.set('model.read', 'b', 60, 'foo')
+        cache._last_sweep -= cache.sweep_interval
+
+        cache.set('model.search', 'c', 60, 'foo')
+
+        self.assertEqual(cache.statistics['entries'], 2)
+        self.assertNotIn('a', cache.store['model.read'])
+        self.assertEqual(cache.statistics['evictions'], 1)
+
+    def test_sweep_interval(self):
+        "Test sweep is not run before the interval"
+        cache = _Cache()
+        cache.set('model.read', 'a', -1, 'foo')
+        cache.set('model.read', 'b', 60, 'foo')
+
+        self.assertEqual(cache.statistics['entries'], 2)
+
+    def test_clear_prefix(self):
+        "Test clear prefix"
+        cache = _Cache()
+        cache.set('model.read', 'a', 60, 'foo')
+        cache.set('model.search', 'b', 60, 'foo')
+
+        cache.clear('model.read')
+
+        self.assertTrue(cache.cached('model.read'))
+        self.assertEqual(cache.statistics['entries'], 1)
+        self.assertEqual(cache.sizes['model.read'], 0)
+        self.assertEqual(cache.size, 6)
+
+    def test_clear(self):
+        "Test clear"
+        cache = _Cache()
+        cache.set('model.read', 'a', 60, 'foo')
+
+        cache.clear()
+
+        self.assertFalse(cache.cached('model.read'))
+        self.assertEqual(cache.size, 0)
+
+
+class PersistentCacheTestCase(TestCase):
+    "Test persistent cache"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite')
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.directory)
+
+    def cache(self, namespace='user@host:8000/db', **kwargs):
+        cache = _PersistentCache(self.path, namespace, **kwargs)
+        self.caches.append(cache)
+        return cache
+
+    def test_persistent(self):
+        "Test value is kept between sessions"
+        cache = self.cache()
+        cache.set('model.read', 'key', 60, {'foo': 'bar'})
+        cache.close()
+
+        cache = self.cache()
+
+        self.assertTrue(cache.cached('model.read'))
+        self.assertEqual(cache.get('model.read', 'key'), {'foo': 'bar'})
+
+    def test_types(self):
+        "Test values are decoded"
+        value = {
+            'date': dt.date(2020, 1, 1),
+            'datetime': dt.datetime(2020, 1, 1, 12, 30),
+            'bytes': b'foo',
+            }
+        cache = self.cache()
+        cache.set('model.read', 'key', 60, value)
+        cache.close()
+
+        cache = self.cache()
+
+        self.assertEqual(cache.get('model.read', 'key'), value)
+
+    def test_expire(self):
+        "Test expired value"
+        cache = self.cache()
+        cache.set('model.read', 'key', -1, 'foo')
+
+        with self.assertRaises(KeyError):
+            cache.get('model.read', 'key')
+
+    def test_expire_disk(self):
+        "Test expired value is removed from disk"
+        cache = self.cache()
+        cache.set('model.read', 'key', -1, 'foo')
+        cache.close()
+
+        cache = self.cache()
+
+        self.assertFalse(cache.cached('model.read'))
+        with self.assertRaises(KeyError):
+            cache.get('model.read', 'key')
+
+    def test_namespace(self):
+        "Test namespaces are isolated"
+        cache = self.cache('user@host:8000/db1')
+        cache.set('model.read', 'key', 60, 'foo')
+        cache.close()
+
+        other = self.cache('user@host:8000/db2')
+        with self.assertRaises(KeyError):
+            other.get('model.read', 'key')
+        other.clear()
+
+        cache = self.cache('user@host:8000/db1')
+        self.assertEqual(cache.get('model.read', 'key'), 'foo')
+
+    def test_size(self):
+        "Test the number of entries on disk is bounded"
+        cache = self.cache(size=2)
+        for key in ['a', 'b', 'c']:
+            cache.set('model.read', key, 60, key)
+        cache.close()
+
+        cache = self.cache(size=2)
+
+        values = []
+        for key in ['a', 'b', 'c']:
+            try:
+                values.append(cache.get('model.read', key))
+            except KeyError:
+                pass
+        self.assertEqual(len(values), 2)
+
+    def test_clear_prefix(self):
+        "Test clear prefix"
+        cache = self.cache()
+        cache.set('model.read', 'key', 60, 'foo')
+        cache.set('model.search', 'key', 60, 'bar')
+        cache.clear('model.read')
+        cache.close()
+
+        cache = self.cache()
+
+        with self.assertRaises(KeyError):
+            cache.get('model.read', 'key')
+        self.assertEqual(cache.get('model.search', 'key'), 'bar')
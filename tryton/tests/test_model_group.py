@@ -0,0 +1,265 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+from unittest import TestCase
+from unittest.mock import patch
+
+from tryton.common import MODELACCESS
+from tryton.common.blob import BLOBS
+from tryton.gui.window.view_form.model.group import Group
+from tryton.gui.window.view_form.model.record import Record
+
+MODEL = 'test.group'
+FIELDS = {
+    'name': {'name': 'name', 'type': 'char'},
+    'parent': {'name': 'parent', 'type': 'many2one', 'relation': MODEL},
+    }
+
+
+class GroupTestCase(TestCase):
+    "Test Group"
+
+    def setUp(self):
+        MODELACCESS._access[MODEL] = {
+            'read': True, 'write': True, 'create': True, 'delete': True}
+        self.addCleanup(MODELACCESS._access.pop, MODEL)
+
+    def group(self, size):
+        group = Group(MODEL, FIELDS)
+        group.load(list(range(1, size + 1)))
+        return group
+
+    def set_loaded(self, records):
+        Record._set_loaded({r.id: r for r in records}, [{
+                    'id': r.id,
+                    'name': str(r.id),
+                    'parent': None,
+                    'parent.rec_name': '',
+                    'rec_name': str(r.id),
+                    '_timestamp': None,
+                    '_write': True,
+                    '_delete': True,
+                    } for r in records])
+
+    def test_index(self):
+        "Test index after changes"
+        group = self.group(10)
+        for record in group:
+            group.index(record)
+
+        record = group.new(default=False)
+        group.insert(3, record)
+        group._remove(group[0])
+        group.pop(5)
+        group.pop()
+        group.move(group[-1], 0)
+
+        # The positions are updated instead of being computed again
+        self.assertIsNotNone(group._Group__positions)
+        for i, record in enumerate(group):
+            self.assertEqual(group.index(record), i)
+        self.assertEqual(len(group), 8)
+
+    def test_index_missing(self):
+        "Test index of a removed record"
+        group = self.group(10)
+        record = group[4]
+        group.index(record)
+
+        group._remove(record)
+
+        self.assertNotIn(record, group)
+        with self.assertRaises(ValueError):
+            group.index(record)
+
+    @patch('tryton.gui.window.view_form.model.group.RPCExecute')
+    def test_prefetch(self, RPCExecute):
+        "Test prefetch reads the fields of the following records"
+        group = self.group(100)
+        self.set_loaded(group[:10])
+
+        group.prefetch(0, 9, 1)
+
+        (_, model, method, ids, fnames), kwargs = RPCExecute.call_args
+        self.assertEqual((model, method), (MODEL, 'read'))
+        self.assertEqual(ids, list(range(11, 101)))
+        self.assertEqual(set(fnames), {
+                'name', 'parent', 'parent.rec_name', 'rec_name',
+                '_timestamp', '_write', '_delete'})
+        self.assertEqual(kwargs['context'], group[10].get_context())
+
+    @patch('tryton.gui.window.view_form.model.group.RPCExecute')
+    def test_prefetch_backward(self, RPCExecute):
+        "Test prefetch reads the previous records from the nearest"
+        group = self.group(100)
+        self.set_loaded(group[90:])
+
+        group.prefetch(90, 99, -1)
+
+        (_, _, _, ids, fnames), _ = RPCExecute.call_args
+        self.assertEqual(ids, list(range(90, 0, -1)))
+        self.assertIn('name', fnames)
+
+    @patch('tryton.gui.window.view_form.model.group.RPCExecute')
+    def test_prefetch_loaded(self, RPCExecute):
+        "Test prefetch does not read loaded records"
+        group = self.group(20)
+        self.set_loaded(group)
+
+        group.prefetch(0, 9, 1)
+
+        RPCExecute.assert_not_called()
+
+    @patch('tryton.gui.window.view_form.model.group.RPCExecute')
+    def test_prefetch_once(self, RPCExecute):
+        "Test prefetch does not read twice the records being fetched"
+        group = self.group(100)
+        self.set_loaded(group[:10])
+
+        group.prefetch(0, 9, 1)
+        group.prefetch(0, 9, 1)
+
+        self.assertEqual(RPCExecute.call_count, 1)
+
+    @patch('tryton.gui.window.view_form.model.group.RPCExecute')
+    def test_prefetch_fetched(self, RPCExecute):
+        "Test prefetch reads the records with only some fields fetched"
+        group = self.group(20)
+        self.set_loaded(group[:10])
+        Record._set_loaded(
+            {r.id: r for r in group[10:]},
+            [{'id': r.id, 'name': str(r.id)} for r in group[10:]])
+
+        group.prefetch(0, 9, 1)
+
+        (_, _, _, ids, fnames), _ = RPCExecute.call_args
+        self.assertEqual(ids, list(range(11, 21)))
+        self.assertNotIn('name', fnames)
+        self.assertIn('parent', fnames)
+
+    @patch('tryton.gui.window.view_form.model.group.CONFIG', {
+            'client.limit': 10})
+    @patch('tryton.gui.window.view_form.model.group.RPCExecute')
+    def test_fetch(self, RPCExecute):
+        "Test fetch reads only the names by chunks"
+        group = self.group(25)
+        self.set_loaded(group[:5])
+
+        group.fetch(['name'])
+
+        calls = RPCExecute.call_args_list
+        self.assertEqual(
+            [c[0][3] for c in calls],
+            [list(range(6, 16)), list(range(16, 26))])
+        self.assertEqual({tuple(c[0][4]) for c in calls}, {('name',)})
+
+    @patch('tryton.gui.window.view_form.model.group.RPCExecute')
+    def test_fetch_once(self, RPCExecute):
+        "Test fetch does not read twice the records being fetched"
+        group = self.group(10)
+
+        group.fetch(['name'])
+        group.fetch(['name'])
+
+        self.assertEqual(RPCExecute.call_count, 1)
+
+    @patch('tryton.gui.window.view_form.model.group.RPCExecute')
+    def test_fetch_callback(self, RPCExecute):
+        "Test fetch sets the values and marks only the fields loaded"
+        group = self.group(10)
+        group.fetch(['name'])
+        (_, _, _, ids, _), kwargs = RPCExecute.call_args
+
+        kwargs['callback'](
+            lambda: [{'id': id_, 'name': str(id_)} for id_ in ids])
+
+        self.assertEqual(group[0]._loaded, {'name'})
+        self.assertEqual(group[0].value['name'], '1')
+
+    @patch('tryton.gui.window.view_form.model.record.RPCExecute')
+    @patch('tryton.gui.window.view_form.model.group.RPCExecute')
+    def test_load_fetched(self, fetch_rpc, RPCExecute):
+        "Test loading a record reads also the neighbours with fetched fields"
+        group = self.group(10)
+        group.fetch(['name'])
+        _, kwargs = fetch_rpc.call_args
+        kwargs['callback'](
+            lambda: [{'id': r.id, 'name': str(r.id)} for r in group])
+        RPCExecute.return_value = []
+
+        group[0]['*']
+
+        (_, _, _, ids, fnames), _ = RPCExecute.call_args
+        self.assertEqual(sorted(ids), list(range(1, 11)))
+        self.assertIn('parent', fnames)
+
+    def test_destroy_release_binaries(self):
+        "Test destroy releases the binaries of all the records"
+        fields = {
+            'data': {'name': 'data', 'type': 'binary'},
+            'lines': {
+                'name': 'lines', 'type': 'one2many', 'relation': MODEL},
+            }
+        group = Group(MODEL, fields)
+        group.load([1, 2, 3])
+        group.fields['lines'].set(group[0], [4])
+        line, = group[0].value['lines']
+        removed = group[2]
+        group.remove(removed, remove=True, modified=False)
+        blobs = []
+        for record in [group[0], group[1], removed, line]:
+            blob = BLOBS.add(b'data %s' % str(record.id).encode())
+            record.group.fields['data'].set(record, blob)
+            blobs.append(blob)
+
+        group.destroy()
+
+        self.assertTrue(all(b.released for b in blobs))
+
+    @patch('tryton.gui.window.view_form.model.record.RPCExecute')
+    def test_destroy_one2many_keep_binaries(self, RPCExecute):
+        "Test destroying the screen of a one2many keeps the binaries"
+        fields = {
+            'data': {'name': 'data', 'type': 'binary'},
+            'lines': {
+                'name': 'lines', 'type': 'one2many', 'relation': MODEL},
+            }
+        group = Group(MODEL, fields)
+        group.load([1])
+        record, = group
+        group.fields['lines'].set(record, [])
+        lines = record.value['lines']
+        line = lines.new(default=False)
+        lines.add(line)
+        lines.fields['data'].set(line, BLOBS.add(b'data'))
+        record.modified_fields.setdefault('lines')
+
+        # As done by Screen.destroy of the One2Many widget
+        lines.destroy()
+        record.save(force_reload=False)
+
+        (_, _, method, _, values), _ = RPCExecute.call_args
+        self.assertEqual(method, 'write')
+        self.assertEqual(values, {'lines': [('create', [{'data': b'data'}])]})
+
+    def test_destroy_record_release_binaries(self):
+        "Test destroying a record releases the binaries of its lines"
+        fields = {
+            'data': {'name': 'data', 'type': 'binary'},
+            'lines': {
+                'name': 'lines', 'type': 'one2many', 'relation': MODEL},
+            }
+        group = Group(MODEL, fields)
+        group.load([1])
+        record, = group
+        group.fields['lines'].set(record, [])
+        lines = record.value['lines']
+        line = lines.new(default=False)
+        lines.add(line)
+        blob = BLOBS.add(b'data')
+        lines.fields['data'].set(line, blob)
+
+        record.destroy()
+
+        self.assertTrue(blob.released)
+        with self.assertRaises(ValueError):
+            lines.fields['data'].get(line)
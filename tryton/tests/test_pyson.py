@@ -0,0 +1,102 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import datetime as dt
+from unittest import TestCase
+
+from tryton.pyson import (
+    And, Bool, Date, Equal, Eval, Get, Greater, If, In, Len, Less, Not, Or,
+    PYSONDecoder, PYSONEncoder, compile_pyson, get_eval_depends)
+
+
+class PYSONCompileTestCase(TestCase):
+    "Test PYSON compilation"
+
+    def _expressions(self):
+        return [
+            {'readonly': Eval('state') != 'draft'},
+            {'invisible': ~Eval('active', True)},
+            {'required': Bool(Eval('party')) & (Eval('amount', 0) > 10)},
+            [('company', '=', Eval('company', -1)),
+                ('date', '<=', Eval('_parent_move.date'))],
+            If(In(Eval('type'), ['in', 'out']), [('a', '=', 1)], []),
+            Or(Equal(Eval('state'), 'done'), Less(Eval('amount', 0), 0)),
+            And(
+                Greater(Eval('date', None), Date(2020, 1, 1)),
+                Bool(Eval('id'))),
+            Get(Eval('context', {}), 'company', None),
+            Len(Eval('lines', [])),
+            Eval('a.b.c', 'default'),
+            {'context': {'date': Eval('date')}},
+            ]
+
+    def _contexts(self):
+        return [
+            {},
+            {'state': 'draft', 'active': False, 'party': 1, 'amount': 20,
+                'company': 1, '_parent_move': {'date': dt.date(2021, 1, 1)},
+                'type': 'in', 'date': dt.date(2021, 6, 1), 'id': 3,
+                'context': {'company': 2}, 'lines': [1, 2],
+                'a': {'b': {'c': 'value'}}},
+            {'state': 'done', 'amount': -1, 'type': 'other', 'a.b.c': 'flat',
+                'a': None},
+            ]
+
+    def test_compile(self):
+        "Test compiled expressions evaluate like the decoder"
+        for expression in self._expressions():
+            expr = PYSONEncoder().encode(expression)
+            for context in self._contexts():
+                with self.subTest(expr=expr, context=context):
+                    self.assertEqual(
+                        compile_pyson(expr)(context),
+                        PYSONDecoder(context).decode(expr))
+
+    def test_compile_cache(self):
+        "Test compiled expressions are cached"
+        expr = PYSONEncoder().encode(Eval('foo'))
+        self.assertIs(compile_pyson(expr), compile_pyson(expr))
+
+    def test_compile_new_values(self):
+        "Test compiled expressions return new mutable values"
+        expr = PYSONEncoder().encode([('a', '=', Eval('a', []))])
+        result = compile_pyson(expr)({})
+        result[0][2].append(1)
+        self.assertEqual(compile_pyson(expr)({}), [['a', '=', []]])
+
+    def test_compile_not(self):
+        "Test compiled Not"
+        expr = PYSONEncoder().encode(Not(Eval('foo')))
+        self.assertEqual(compile_pyson(expr)({'foo': True}), False)
+        self.assertEqual(compile_pyson(expr)({}), True)
+
+    def test_compile_names(self):
+        "Test names of compiled expressions"
+        for expression, names in [
+                (Eval('foo'), {'foo'}),
+                ({'readonly': Eval('foo', 0) > Eval('bar', 0)},
+                    {'foo', 'bar'}),
+                (Eval('_parent_foo.bar'), {'_parent_foo', '_parent_foo.bar'}),
+                (Eval('foo', Eval('bar')), {'foo', 'bar'}),
+                ([('foo', '=', 1)], set()),
+                (Eval(Eval('foo')), None),
+                ]:
+            expr = PYSONEncoder().encode(expression)
+            with self.subTest(expr=expr):
+                self.assertEqual(compile_pyson(expr).names, names)
+
+    def test_eval_depends(self):
+        "Test depends of expressions"
+        for expressions, depends in [
+                ([Eval('foo')], ({'foo'}, set())),
+                ([Eval('foo.bar'), Eval('_parent_baz.qux.quux')],
+                    ({'foo'}, {'qux'})),
+                ([{'readonly': Eval('foo', 0) > 0}, [('bar', '=', 1)]],
+                    ({'foo'}, set())),
+                ([Eval('context', {}).get('company')], None),
+                ([Eval('_parent_foo')], None),
+                ([Eval(Eval('foo'))], None),
+                ]:
+            exprs = [PYSONEncoder().encode(e) for e in expressions]
+            with self.subTest(exprs=exprs):
+                self.assertEqual(get_eval_depends(*exprs), depends)
+        self.assertEqual(get_eval_depends(None, ''), (set(), set()))